@@ -45,6 +45,8 @@ if !exists('s:voom_did_init')
     let s:voom_bodies = {}
     " force one-time outline verification
     let s:verify = 0
+    " nesting depth of outline operation transactions, see voom#OopBegin()
+    let s:oop_tr = 0
 python << EOF
 import sys, vim
 if not vim.eval("s:voom_dir") in sys.path:
@@ -122,6 +124,7 @@ endif
 
 com! Voomunl call voom#EchoUNL()
 com! -nargs=? Voomgrep call voom#Grep(<q-args>)
+com! -nargs=? -complete=file Voomlatexproject call voom#LatexProject(<q-args>)
 com! -range -nargs=? VoomSort call voom#OopSort(<line1>,<line2>, <q-args>)
 
 com! -range VoomFoldingSave    call voom#OopFolding(<line1>,<line2>, 'save')
@@ -269,13 +272,17 @@ endfunc
 func! voom#Complete(A,L,P) "{{{2
 " Argument completion for command :Voom. Return string "wiki\nvimwiki\nviki..."
 " constructed from file names ../plugin/voom/voom_mode_{whatever}.py .
-    let thefiles = split(glob(s:voom_dir.'/voom_mode_?*.py'), "\n")
-    let themodes = []
-    for the in thefiles
-        let themode = substitute(fnamemodify(the,':t'), '\c^voom_mode_\(.*\)\.py$', '\1', '')
-        call add(themodes, themode)
-    endfor
-    return join(themodes, "\n")
+" The directory is scanned once, the result is kept in s:voom_modes.
+    if !exists('s:voom_modes')
+        let thefiles = split(glob(s:voom_dir.'/voom_mode_?*.py'), "\n")
+        let themodes = []
+        for the in thefiles
+            let themode = substitute(fnamemodify(the,':t'), '\c^voom_mode_\(.*\)\.py$', '\1', '')
+            call add(themodes, themode)
+        endfor
+        let s:voom_modes = join(themodes, "\n")
+    endif
+    return s:voom_modes
 endfunc
 
 
@@ -550,7 +557,7 @@ func! voom#Voominfo(qargs) "{{{2
     endif
     let l:vimvars = ''
     if a:qargs==#'all'
-        for var in ['s:script_path', 's:script_dir', 's:voom_dir', 'g:voom_did_load_plugin', 's:voom_did_init', 's:voom_logbnr', 's:verify', 'g:voom_verify_oop', 's:voom_trees', 's:voom_bodies']
+        for var in ['s:script_path', 's:script_dir', 's:voom_dir', 'g:voom_did_load_plugin', 's:voom_did_init', 's:voom_logbnr', 's:verify', 's:oop_tr', 'g:voom_verify_oop', 's:voom_trees', 's:voom_bodies']
             let l:vimvars = l:vimvars . printf("%-13s = %s\n", var, string({var}))
         endfor
     endif
@@ -574,6 +581,7 @@ for k in sys.modules.keys():
 del k
 EOF
     unlet s:voom_did_init
+    if exists('s:voom_modes') | unlet s:voom_modes | endif
 endfunc
 
 
@@ -830,6 +838,8 @@ func! voom#TreeCreate(body, blnr) "{{{2
     let s:voom_bodies[a:body].tick_ = 0
     python _VOoM.VOOMS[int(vim.eval('a:body'))].tree = int(vim.eval('l:tree'))
     python _VOoM.VOOMS[int(vim.eval('a:body'))].Tree = vim.current.buffer
+    " create b:voom_fde if possible, see voom#TreeConfigWin()
+    python _VOoM.treeFdeInit(int(vim.eval('a:body')))
 
     call voom#TreeConfig()
     let l:blnShow = -1
@@ -917,7 +927,12 @@ func! voom#TreeConfigWin() "{{{2
     setl foldenable
     setl foldtext=getline(v:foldstart).'\ \ \ /'.(v:foldend-v:foldstart)
     setl foldmethod=expr
-    setl foldexpr=voom#TreeFoldexpr(v:lnum)
+    " b:voom_fde is list of 'foldexpr' values of Tree lines computed by Python
+    if exists('b:voom_fde')
+        setl foldexpr=get(get(b:,'voom_fde',[]),v:lnum-1,0)
+    else
+        setl foldexpr=voom#TreeFoldexpr(v:lnum)
+    endif
     setl cul nocuc nowrap nolist
     "setl winfixheight
     setl winfixwidth
@@ -1021,6 +1036,7 @@ endfunc
 
 
 func! voom#TreeFoldexpr(lnum) "{{{2
+" Used if Python can't maintain b:voom_fde, see treeSetLines() in voom_vim.py
     let ind = stridx(getline(a:lnum),'|') / 2
     let indn = stridx(getline(a:lnum+1),'|') / 2
     return indn>ind ? '>'.ind : ind-1
@@ -1155,33 +1171,33 @@ nnoremap <buffer><silent> <LocalLeader>A :<C-u>call voom#OopInsert('as_child')<C
 nnoremap <buffer><silent>             AA :<C-u>call voom#OopInsert('as_child')<CR>
 
 " move
-nnoremap <buffer><silent> <LocalLeader>u :<C-u>call voom#Oop('up', 'n')<CR>
-nnoremap <buffer><silent>         <C-Up> :<C-u>call voom#Oop('up', 'n')<CR>
-nnoremap <buffer><silent>             ^^ :<C-u>call voom#Oop('up', 'n')<CR>
-vnoremap <buffer><silent> <LocalLeader>u :<C-u>call voom#Oop('up', 'v')<CR>
-vnoremap <buffer><silent>         <C-Up> :<C-u>call voom#Oop('up', 'v')<CR>
-vnoremap <buffer><silent>             ^^ :<C-u>call voom#Oop('up', 'v')<CR>
-
-nnoremap <buffer><silent> <LocalLeader>d :<C-u>call voom#Oop('down', 'n')<CR>
-nnoremap <buffer><silent>       <C-Down> :<C-u>call voom#Oop('down', 'n')<CR>
-nnoremap <buffer><silent>             __ :<C-u>call voom#Oop('down', 'n')<CR>
-vnoremap <buffer><silent> <LocalLeader>d :<C-u>call voom#Oop('down', 'v')<CR>
-vnoremap <buffer><silent>       <C-Down> :<C-u>call voom#Oop('down', 'v')<CR>
-vnoremap <buffer><silent>             __ :<C-u>call voom#Oop('down', 'v')<CR>
-
-nnoremap <buffer><silent> <LocalLeader>l :<C-u>call voom#Oop('left', 'n')<CR>
-nnoremap <buffer><silent>       <C-Left> :<C-u>call voom#Oop('left', 'n')<CR>
-nnoremap <buffer><silent>             << :<C-u>call voom#Oop('left', 'n')<CR>
-vnoremap <buffer><silent> <LocalLeader>l :<C-u>call voom#Oop('left', 'v')<CR>
-vnoremap <buffer><silent>       <C-Left> :<C-u>call voom#Oop('left', 'v')<CR>
-vnoremap <buffer><silent>             << :<C-u>call voom#Oop('left', 'v')<CR>
-
-nnoremap <buffer><silent> <LocalLeader>r :<C-u>call voom#Oop('right', 'n')<CR>
-nnoremap <buffer><silent>      <C-Right> :<C-u>call voom#Oop('right', 'n')<CR>
-nnoremap <buffer><silent>             >> :<C-u>call voom#Oop('right', 'n')<CR>
-vnoremap <buffer><silent> <LocalLeader>r :<C-u>call voom#Oop('right', 'v')<CR>
-vnoremap <buffer><silent>      <C-Right> :<C-u>call voom#Oop('right', 'v')<CR>
-vnoremap <buffer><silent>             >> :<C-u>call voom#Oop('right', 'v')<CR>
+nnoremap <buffer><silent> <LocalLeader>u :<C-u>call voom#Oop('up', 'n', v:count1)<CR>
+nnoremap <buffer><silent>         <C-Up> :<C-u>call voom#Oop('up', 'n', v:count1)<CR>
+nnoremap <buffer><silent>             ^^ :<C-u>call voom#Oop('up', 'n', v:count1)<CR>
+vnoremap <buffer><silent> <LocalLeader>u :<C-u>call voom#Oop('up', 'v', v:count1)<CR>
+vnoremap <buffer><silent>         <C-Up> :<C-u>call voom#Oop('up', 'v', v:count1)<CR>
+vnoremap <buffer><silent>             ^^ :<C-u>call voom#Oop('up', 'v', v:count1)<CR>
+
+nnoremap <buffer><silent> <LocalLeader>d :<C-u>call voom#Oop('down', 'n', v:count1)<CR>
+nnoremap <buffer><silent>       <C-Down> :<C-u>call voom#Oop('down', 'n', v:count1)<CR>
+nnoremap <buffer><silent>             __ :<C-u>call voom#Oop('down', 'n', v:count1)<CR>
+vnoremap <buffer><silent> <LocalLeader>d :<C-u>call voom#Oop('down', 'v', v:count1)<CR>
+vnoremap <buffer><silent>       <C-Down> :<C-u>call voom#Oop('down', 'v', v:count1)<CR>
+vnoremap <buffer><silent>             __ :<C-u>call voom#Oop('down', 'v', v:count1)<CR>
+
+nnoremap <buffer><silent> <LocalLeader>l :<C-u>call voom#Oop('left', 'n', v:count1)<CR>
+nnoremap <buffer><silent>       <C-Left> :<C-u>call voom#Oop('left', 'n', v:count1)<CR>
+nnoremap <buffer><silent>             << :<C-u>call voom#Oop('left', 'n', v:count1)<CR>
+vnoremap <buffer><silent> <LocalLeader>l :<C-u>call voom#Oop('left', 'v', v:count1)<CR>
+vnoremap <buffer><silent>       <C-Left> :<C-u>call voom#Oop('left', 'v', v:count1)<CR>
+vnoremap <buffer><silent>             << :<C-u>call voom#Oop('left', 'v', v:count1)<CR>
+
+nnoremap <buffer><silent> <LocalLeader>r :<C-u>call voom#Oop('right', 'n', v:count1)<CR>
+nnoremap <buffer><silent>      <C-Right> :<C-u>call voom#Oop('right', 'n', v:count1)<CR>
+nnoremap <buffer><silent>             >> :<C-u>call voom#Oop('right', 'n', v:count1)<CR>
+vnoremap <buffer><silent> <LocalLeader>r :<C-u>call voom#Oop('right', 'v', v:count1)<CR>
+vnoremap <buffer><silent>      <C-Right> :<C-u>call voom#Oop('right', 'v', v:count1)<CR>
+vnoremap <buffer><silent>             >> :<C-u>call voom#Oop('right', 'v', v:count1)<CR>
 
 " cut/copy/paste
 nnoremap <buffer><silent> dd :<C-u>call voom#Oop('cut', 'n')<CR>
@@ -1395,7 +1411,7 @@ func! voom#TreeLeft() "{{{3
     elseif ind < 3
     " go to parent
     else
-        call search('\m^[^|]\{0,'.(ind-2).'}|', 'bWe')
+        call voom#TreeGoTo('P', 1)
     endif
     call voom#TreeSelect(1)
 endfunc
@@ -1445,42 +1461,9 @@ func! voom#Tree_KJUD(action, mode) "{{{3
             exe 'keepj normal! '.ln1.'G'
         endif
     endif
-    " node's level is indent of first |
-    keepj normal! 0f|
-    let ind = virtcol('.')-1
-    let lnum = line('.')
-
-    " go to the downmost sibling: down to next elder, up to sibling
-    if a:action==#'D'
-        call search('\m^[^|]\{0,'.(ind-2).'}|', 'We')
-        if line('.') > lnum
-            call search('\m^[^|]\{'.(ind).'}|', 'bWe')
-        else
-            keepj normal! G0f|
-            call search('\m^[^|]\{'.(ind).'}|', 'bcWe')
-        endif
-    " go to the uppermost sibling: up to parent, down to sibling
-    elseif a:action==#'U'
-        call search('\m^[^|]\{0,'.(ind-2).'}|', 'bWe')
-        if line('.') < lnum
-            call search('\m^[^|]\{'.(ind).'}|', 'We')
-        else
-            keepj normal! gg
-            call search('\m^[^|]\{'.(ind).'}|', 'We')
-        endif
-    " go down to the next sibling, stopline is next elder node
-    elseif a:action==#'J'
-        let stopline = search('\m^[^|]\{0,'.(ind-2).'}|', 'Wn')
-        for i in range(vcount1)
-            call search('\m^[^|]\{'.(ind).'}|', 'We', stopline)
-        endfor
-    " go up to the previous sibling, stopline is parent
-    elseif a:action==#'K'
-        let stopline = search('\m^[^|]\{0,'.(ind-2).'}|', 'bWn')
-        for i in range(vcount1)
-            call search('\m^[^|]\{'.(ind).'}|', 'bWe', stopline)
-        endfor
-    endif
+    " go to the uppermost or downmost sibling, or to the previous or next
+    " sibling vcount1 times
+    call voom#TreeGoTo(a:action, vcount1)
     call voom#TreeZV()
 
     " restore and extend Visual selection
@@ -1491,6 +1474,15 @@ func! voom#Tree_KJUD(action, mode) "{{{3
 endfunc
 
 
+func! voom#TreeGoTo(action, vcount1) "{{{3
+" Move cursor to | of the node specified by action (U D K J P) relative to
+" the node at the current line. See voom_TreeNav().
+    let [body, lnum, action, vcount1] = [s:voom_trees[bufnr('')], line('.'), a:action, a:vcount1]
+    python _VOoM.voom_TreeNav()
+    call cursor(lnum, stridx(getline(lnum),'|')+1)
+endfunc
+
+
 func! voom#Tree_Pco(action, mode) "{{{3
 " action: P c o
     if voom#TreeZV() < 0
@@ -1502,9 +1494,7 @@ func! voom#Tree_Pco(action, mode) "{{{3
 
     """ action 'P' or 'c': go up to parent, contract if 'c'
     if a:action==#'c' || a:action==#'P'
-        keepj normal! 0f|
-        let ind = virtcol('.')-1
-        call search('\m^[^|]\{0,'.(ind-2).'}|', 'bWe')
+        call voom#TreeGoTo('P', 1)
         if a:action==#'c' && line('.') < lnum
             normal! zc
         endif
@@ -1871,9 +1861,24 @@ func! voom#OopMarkStartup() "{{{3
 endfunc
 
 
-func! voom#Oop(op, mode) "{{{3
+func! voom#Oop(op, mode, ...) "{{{3
 " Outline operations that can be perfomed on the current node or on nodes in
 " Visual selection. All apply to branches, not to single nodes.
+" Optional argument is count: repeat operation count times as one transaction.
+" Return 1 if outline was changed, 0 otherwise.
+    if a:0 && a:1 > 1
+        let changed = 0
+        call voom#OopBegin()
+        try
+            for i in range(a:1)
+                if !voom#Oop(a:op, a:mode) | break | endif
+                let changed = 1
+            endfor
+        finally
+            call voom#OopEnd()
+        endtry
+        return changed
+    endif
     " Checks and init vars. {{{
     let tree = bufnr('')
     if voom#BufNotTree(tree) | return | endif
@@ -2037,6 +2042,7 @@ func! voom#Oop(op, mode) "{{{3
     if l:doverif
         call voom#OopVerify(body, tree, a:op)
     endif
+    return l:blnShow > 0
 endfunc
 
 
@@ -2070,10 +2076,12 @@ func! voom#OopFolding(ln1, ln2, action) "{{{3
 
     """ diddle with folds
     let winsave_dict = winsaveview()
+    let l:changed = 0
     python _VOoM.voom_OopFolding(vim.eval('a:action'))
     call winrestview(winsave_dict)
 
-    if a:action==#'restore' | let &lz=lz_ | return | endif
+    " nothing to do if 'restore' or if no Body headlines were changed
+    if !l:changed | let &lz=lz_ | return | endif
 
     " go to Body, set ticks, go back
     if voom#ToBody(body) < 0 | let &lz=lz_ | return | endif
@@ -2110,14 +2118,24 @@ func! voom#OopSort(ln1,ln2,qargs) "{{{3
 
     " default l:bnlShow -1 means no changes were made
     let l:blnShow = -1
-    " Modify Body buffer. NOTE: Tree buffer and outline data are not adjusted.
+    " l:doverif 1 means Tree buffer and outline data were adjusted
+    let l:doverif = 0
+    " Modify Body buffer. Modify Tree buffer and outline data if possible.
+    call setbufvar(tree, '&ma', 1)
     keepj python _VOoM.voom_OopSort()
-    " IMPORTANT: we rely on Tree BufEnter au to update outline
+    " IMPORTANT: otherwise we rely on Tree BufEnter au to update outline
+    if !l:doverif
+        call setbufvar(tree, '&ma', 0)
+    endif
     call voom#OopFromBody(body,tree,l:blnShow)
+    call setbufvar(tree, '&ma', 0)
     if l:blnShow > 0
         call voom#OopShowTree(l:lnum1, l:lnum2, a:ln1==a:ln2 ? 'n' : 'v')
     endif
     let &lz=lz_
+    if l:doverif
+        call voom#OopVerify(body, tree, 'sort')
+    endif
 
     " Sorting must not change the number of headlines!
     " (This is problem with reST, asciidoc, Python modes.)
@@ -2214,13 +2232,63 @@ func! voom#OopShowTree(ln1, ln2, mode) " {{{3
 endfunc
 
 
+func! voom#OopBegin() "{{{3
+" Start outline operation transaction. Outline operations performed until the
+" matching voom#OopEnd() are verified once, by voom#OopEnd(), and the screen is
+" not redrawn until then ('lazyredraw' is set). Transactions can be nested.
+    if !s:oop_tr
+        let s:oop_tr_lz = &lz
+        set lz
+        " {body : [tree, ops], ...} outlines to verify
+        let s:oop_tr_verify = {}
+    endif
+    let s:oop_tr += 1
+endfunc
+
+
+func! voom#OopEnd() "{{{3
+" End outline operation transaction started by voom#OopBegin().
+" Verify outlines changed during the transaction.
+    if !s:oop_tr | return | endif
+    let s:oop_tr -= 1
+    if s:oop_tr | return | endif
+    let &lz = s:oop_tr_lz
+    for [body, v] in items(s:oop_tr_verify)
+        let [body, tree, ops] = [str2nr(body), v[0], v[1]]
+        if !has_key(s:voom_bodies, body) || s:voom_bodies[body].tree != tree
+            continue
+        " verification needs current buffer to be Tree; otherwise force
+        " outline update on the next Tree BufEnter
+        if bufnr('')==tree
+            call voom#OopVerify(body, tree, ops)
+        else
+            let s:voom_bodies[body].tick_ = -1
+        endif
+    endfor
+    let s:oop_tr_verify = {}
+endfunc
+
+
 func! voom#OopVerify(body, tree, op) "{{{3
 " Verify outline after outline operation. Current buffer must be Tree.
+" During transaction only remember what to verify, see voom#OopBegin().
+    if s:oop_tr
+        if !has_key(s:oop_tr_verify, a:body)
+            let s:oop_tr_verify[a:body] = [a:tree, a:op]
+        elseif stridx(', '.s:oop_tr_verify[a:body][1].', ', ', '.a:op.', ') < 0
+            let s:oop_tr_verify[a:body][1] .= ', '.a:op
+        endif
+        return
+    endif
+    " l:full: re-parse entire Body instead of only changed nodes
+    let l:full = 0
     if s:verify
         let s:verify = 0
+        let l:full = 1
     elseif !g:voom_verify_oop
         return
     endif
+    let l:full = l:full || g:voom_verify_oop > 1
     let l:ok = 0
     python _VOoM.voom_OopVerify()
     if l:ok | return | endif
@@ -2409,7 +2477,8 @@ endfunc
 func! voom#Grep(input) "{{{2
 " Seach Body for pattern(s). Show list of UNLs of nodes with matches.
 " Input can have several patterns separated by boolean 'AND' and 'NOT'.
-" Stop if >500000 matches found for a pattern.
+" Matches are passed to Python in batches as they are found, see
+" voom#GrepSearch(). There is no limit on the number of matches.
 " Set "/ register to AND patterns.
 
     """ Process input first in case we are in Tree and want word under cursor.
@@ -2448,20 +2517,18 @@ func! voom#Grep(input) "{{{2
     let [lnum_,cnum_] = [line('.'), col('.')]
     let lz_ = &lz | set lz
     let winsave_dict = winsaveview()
-    " search results: list of lists with blnums for each pattern
-    let [matchesAND, matchesNOT] = [[], []]
-    " inheritance flags (hierarchical search): 0 or 1
-    let [inhAND, inhNOT] = [[], []]
+    " numbers of matches for each pattern
+    let [countsAND, countsNOT] = [[], []]
     let pattsAND1 = []
+    python _VOoM.voom_GrepStart()
     for patt in pattsAND
-        if patt =~ '\m^\*.'
+        " inheritance flag (hierarchical search): 0 or 1
+        let inh = patt =~ '\m^\*.'
+        if inh
             let patt = patt[1:]
-            call add(inhAND, 1)
-        else
-            call add(inhAND, 0)
         endif
         call add(pattsAND1, patt)
-        let [matches, notOK] = voom#GrepSearch(patt)
+        let [n, notOK] = voom#GrepSearch(patt, 'AND', inh)
         if notOK
             if notOK == 1
                 call voom#ErrorMsg('VOoM (Voomgrep): pattern not found: '. patt)
@@ -2471,23 +2538,21 @@ func! voom#Grep(input) "{{{2
             let &lz=lz_
             return
         endif
-        call add(matchesAND, matches)
+        call add(countsAND, n)
     endfor
     for patt in pattsNOT
-        if patt =~ '\m^\*.'
+        let inh = patt =~ '\m^\*.'
+        if inh
             let patt = patt[1:]
-            call add(inhNOT, 1)
-        else
-            call add(inhNOT, 0)
         endif
-        let [matches, notOK] = voom#GrepSearch(patt)
+        let [n, notOK] = voom#GrepSearch(patt, 'NOT', inh)
         if notOK > 1
             call winrestview(winsave_dict)
             call winline()
             let &lz=lz_
             return
         endif
-        call add(matchesNOT, matches)
+        call add(countsNOT, n)
     endfor
     call winrestview(winsave_dict)
     call winline()
@@ -2513,16 +2578,14 @@ func! voom#Grep(input) "{{{2
     " 2nd line shows patterns and numbers of matches
     let line2 = ':Voomgrep'
     for i in range(lenAND)
-        let L = matchesAND[i]
         if i == 0
-            let line2 = line2 .    '  '. pattsAND[i] .' {'. len(L) .' matches}'
+            let line2 = line2 .    '  '. pattsAND[i] .' {'. countsAND[i] .' matches}'
         else
-            let line2 = line2 .'  AND '. pattsAND[i] .' {'. len(L) .' matches}'
+            let line2 = line2 .'  AND '. pattsAND[i] .' {'. countsAND[i] .' matches}'
         endif
     endfor
     for i in range(lenNOT)
-        let L = matchesNOT[i]
-        let line2 = line2 .'  NOT '. pattsNOT[i] .' {'. len(L) .' matches}'
+        let line2 = line2 .'  NOT '. pattsNOT[i] .' {'. countsNOT[i] .' matches}'
     endfor
     " initiate quickfix list with two lines
     call setqflist([{'text':line1, 'bufnr':body, 'lnum':lnum_, 'col':cnum_}, {'text':line2}])
@@ -2577,10 +2640,13 @@ func! voom#GrepParseInput(input) "{{{2
 endfunc
 
 
-func! voom#GrepSearch(pattern) "{{{2
-" Seach buffer for pattern. Return [[lnums-of-matches], notOK] .
-" notOK is 0 (success), 1 (no matches), 2 (search stopped after >500000 matches found).
-    let [matches, notOK, n] = [[], 0, 0]
+func! voom#GrepSearch(pattern, kind, inh) "{{{2
+" Seach buffer for pattern. Return [number-of-matches, notOK] .
+" notOK is 0 (success), 1 (no matches), 4 (search interrupted).
+" Lnums of matches are passed to Python in batches of 10000 as they are found:
+" kind is 'AND' or 'NOT', inh is 1 if search is hierarchical.
+    let [kind, inh] = [a:kind, a:inh]
+    let [matches, notOK, n, first, done] = [[], 0, 0, 1, 0]
     " always search from start
     keepj normal! gg0
     " special effort needed to detect match at cursor
@@ -2594,22 +2660,53 @@ func! voom#GrepSearch(pattern) "{{{2
         while found > 0
             call add(matches, found)
             let n += 1
-            if n > 500000
-                call voom#ErrorMsg('VOoM (Voomgrep): too many matches (>500000) for pattern: '. a:pattern)
-                return [[], 2]
+            if len(matches) == 10000
+                python _VOoM.voom_GrepAdd()
+                let [matches, first] = [[], 0]
             endif
             let found = search(a:pattern, 'W')
         endwhile
     catch /^Vim:Interrupt$/
         " FIXME this message is not visible, it is overwritten by Vim's CTRL-C message
         call voom#ErrorMsg("VOoM (Voomgrep): search interrupted after ". n ." matches found for pattern: " .a:pattern)
-        return [[], 4]
+        return [n, 4]
     endtry
+    let done = 1
+    python _VOoM.voom_GrepAdd()
     " no matches found
-    if matches == []
+    if n == 0
         let notOK = 1
     endif
-    return [matches, notOK]
+    return [n, notOK]
+endfunc
+
+
+func! voom#LatexProject(qargs) "{{{2
+" Show outline of LaTeX project in quickfix window: master file and all files
+" included with \input and \include. Master file is qargs or the file of the
+" current buffer (of Body if in Tree).
+    if a:qargs==''
+        let bnr = bufnr('')
+        if has_key(s:voom_trees, bnr)
+            let bnr = s:voom_trees[bnr]
+        endif
+        if bufname(bnr)==''
+            call voom#ErrorMsg('VOoM (Voomlatexproject): current buffer has no name')
+            return
+        endif
+        let l:master = fnamemodify(bufname(bnr), ':p')
+    else
+        let l:master = fnamemodify(expand(a:qargs), ':p')
+    endif
+    if !filereadable(l:master) && !bufloaded(l:master)
+        call voom#ErrorMsg('VOoM (Voomlatexproject): cannot read file: '.l:master)
+        return
+    endif
+    let l:nodes = -1
+    call setqflist([{'text':':Voomlatexproject '.l:master}])
+    python _VOoM.voom_LatexProject()
+    if l:nodes < 0 | return | endif
+    botright copen
 endfunc
 
 
@@ -2872,6 +2969,11 @@ func! voom#Exec(qargs) "{{{2
 " Execute text from the current node (Tree or Body, include subnodes) or fold
 " (non-VOoM buffer, include subfolds) as a script.
 " If argument is 'vim' or 'py'/'python': execute as Vim or Python script.
+" If argument is 'changed': execute as Python script node by node in
+" persistent namespace, skip nodes that are unchanged since the last run.
+" If argument is 'reset': delete persistent namespace of the current buffer.
+" If argument is 'bg': execute as Python script in background thread.
+" If argument is 'cancel': cancel background Python script.
 " Otherwise execute according to filetype.
 
     " If current buffer is a Tree: use Body filetype, encodings, etc.
@@ -2880,11 +2982,32 @@ func! voom#Exec(qargs) "{{{2
         let bnr = s:voom_trees[bnr]
     endif
     let FT = getbufvar(bnr, '&ft')
+    let [changed, bg] = [0, 0]
 
     if a:qargs==#'vim'
         let scriptType = 'vim'
     elseif a:qargs==#'py' || a:qargs==#'python'
         let scriptType = 'python'
+    elseif a:qargs==#'changed'
+        if !has_key(s:voom_bodies, bnr)
+            call voom#ErrorMsg('VOoM: "Voomexec changed" requires VOoM outline')
+            return
+        endif
+        if bnr==bufnr('') && voom#BodyUpdateTree() < 0 | return | endif
+        let [scriptType, changed] = ['python', 1]
+    elseif a:qargs==#'reset'
+        let body = bnr
+        python _VOoM.voom_ExecReset()
+        return
+    elseif a:qargs==#'bg'
+        if !has('timers')
+            call voom#ErrorMsg('VOoM: "Voomexec bg" requires Vim with +timers feature')
+            return
+        endif
+        let [scriptType, bg] = ['python', 1]
+    elseif a:qargs==#'cancel'
+        python _VOoM.voom_ExecCancel()
+        return
     elseif a:qargs!=''
         call voom#ErrorMsg('VOoM: unsupported script type: "'.a:qargs.'"')
         return
@@ -2923,6 +3046,14 @@ func! voom#Exec(qargs) "{{{2
         endtry
     " Execute Python script.
     elseif scriptType==#'python'
+        if bg
+            let started = 0
+            python _VOoM.voom_ExecBg()
+            if started
+                call timer_start(100, 'voom#ExecPoll', {'repeat': -1})
+            endif
+            return
+        endif
         " do not change, see ./voom/voom_vim.py#id_20101214100357
         if s:voom_logbnr
             try
@@ -2942,6 +3073,33 @@ func! s:ExecVim() "{{{2
 endfunc
 
 
+func! voom#ExecPoll(timer) "{{{2
+" Timer callback: print output of background Python script started by
+" "Voomexec bg", stop when script is finished.
+    let done = 0
+    python _VOoM.voom_ExecPoll()
+    if done
+        call timer_stop(a:timer)
+    endif
+endfunc
+
+
+func! voom#ExecBufAu(body) "{{{2
+" Python namespace of Voomexec scripts was created for buffer body. Free it
+" when the buffer is deleted or wiped out.
+    augroup VoomExec
+        exe 'au! * <buffer='.a:body.'>'
+        exe 'au BufDelete,BufWipeout <buffer='.a:body.'> call voom#ExecBufDelete('.a:body.')'
+    augroup END
+endfunc
+
+
+func! voom#ExecBufDelete(body) "{{{2
+    exe 'au! VoomExec * <buffer='.a:body.'>'
+    python _VOoM.voom_ExecFree()
+endfunc
+
+
 "---execute user command----------------------{{{1
 if exists('g:voom_user_command')
     execute g:voom_user_command
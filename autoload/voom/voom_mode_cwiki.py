@@ -24,6 +24,9 @@ First + must be at start of line. Whitespace after the last + is optional.
 import re
 headline_match = re.compile(r'^\+\+(\++)').match
 
+# Headlines depend only on their own Body lines, see voom_vim.voom_Init().
+HEADS_CONTEXT_FREE = 1
+
 
 def hook_makeOutline(VO, blines):
     """Return (tlines, bnodes, levels) for Body lines blines.
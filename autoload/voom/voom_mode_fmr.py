@@ -12,3 +12,5 @@ See |voom-mode-fmr|, ../../doc/voom.txt#*voom-mode-fmr*
 
 # Define this mode as an 'fmr' mode.
 MTYPE = 0
+# Headlines depend only on their own Body lines, see voom_vim.voom_Init().
+HEADS_CONTEXT_FREE = 1
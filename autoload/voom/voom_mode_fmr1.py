@@ -18,6 +18,8 @@ more text
 
 # Define this mode as an 'fmr' mode.
 MTYPE = 0
+# Headlines depend only on their own Body lines, see voom_vim.voom_Init().
+HEADS_CONTEXT_FREE = 1
 
 # voom_vim.makeoutline() without char stripping
 def hook_makeOutline(VO, blines):
@@ -29,6 +31,9 @@ def hook_makeOutline(VO, blines):
     Z = len(blines)
     tlines, bnodes, levels = [], [], []
     tlines_add, bnodes_add, levels_add = tlines.append, bnodes.append, levels.append
+    # 'x', 'o', '=' flags of nodes, see voom_vim.fmrFlags()
+    flags = bytearray(1)
+    flags_add = flags.append
     #c = VO.rstrip_chars
     for i in xrange(Z):
         if not marker in blines[i]: continue
@@ -38,10 +43,22 @@ def hook_makeOutline(VO, blines):
         lev = int(m.group(1))
         #head = bline[:m.start()].lstrip().rstrip(c).strip('-=~').strip()
         head = bline[:m.start()].strip()
-        tline = ' %s%s|%s' %(m.group(2) or ' ', '. '*(lev-1), head)
+        x = m.group(2)
+        tline = ' %s%s|%s' %(x or ' ', '. '*(lev-1), head)
         tlines_add(tline)
         bnodes_add(i+1)
         levels_add(lev)
+        f = x and 1 or 0
+        s = bline[m.end():m.end()+2]
+        if s:
+            if s[0]=='o':
+                f |= 2
+                if s[1:]=='=': f |= 4
+            elif s[0]=='=':
+                f |= 4
+        flags_add(f)
+    if blines is VO.Body:
+        VO.fmrFlags = flags
     return (tlines, bnodes, levels)
 
 
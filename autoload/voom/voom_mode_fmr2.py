@@ -17,6 +17,8 @@ more text
 
 # Define this mode as an 'fmr' mode.
 MTYPE = 0
+# Headlines depend only on their own Body lines, see voom_vim.voom_Init().
+HEADS_CONTEXT_FREE = 1
 
 
 def hook_makeOutline(VO, blines):
@@ -28,6 +30,9 @@ def hook_makeOutline(VO, blines):
     Z = len(blines)
     tlines, bnodes, levels = [], [], []
     tlines_add, bnodes_add, levels_add = tlines.append, bnodes.append, levels.append
+    # 'x', 'o', '=' flags of nodes, see voom_vim.fmrFlags()
+    flags = bytearray(1)
+    flags_add = flags.append
     #c = VO.rstrip_chars
     for i in xrange(Z):
         if not marker in blines[i]: continue
@@ -37,13 +42,22 @@ def hook_makeOutline(VO, blines):
         lev = int(m.group(1))
         #head = bline[:m.start()].lstrip().rstrip(c).strip('-=~').strip()
         head = bline[m.end():]
-        # strip special marks o=
-        if head and head[0]=='o': head = head[1:]
-        if head and head[0]=='=': head = head[1:]
-        tline = ' %s%s|%s' %(m.group(2) or ' ', '. '*(lev-1), head.strip())
+        # strip special marks o=, node flags: 1 'x', 2 'o', 4 '='
+        x = m.group(2)
+        f = x and 1 or 0
+        if head and head[0]=='o':
+            head = head[1:]
+            f |= 2
+        if head and head[0]=='=':
+            head = head[1:]
+            f |= 4
+        tline = ' %s%s|%s' %(x or ' ', '. '*(lev-1), head.strip())
         tlines_add(tline)
         bnodes_add(i+1)
         levels_add(lev)
+        flags_add(f)
+    if blines is VO.Body:
+        VO.fmrFlags = flags
     return (tlines, bnodes, levels)
 
 
@@ -25,6 +25,10 @@ headline_match = re.compile(r'^(%s+)' %re.escape(CHAR)).match
 # Use this if a whitespace is required after marker chars (as in org-mode).
 #headline_match = re.compile(r'^(%s+)\s' %re.escape(CHAR)).match
 
+# Headlines depend only on their own Body lines, see voom_vim.voom_Init().
+HEADS_CONTEXT_FREE = 1
+
+
 def hook_makeOutline(VO, blines):
     """Return (tlines, bnodes, levels) for Body lines blines.
     blines is either Vim buffer object (Body) or list of buffer lines.
@@ -46,6 +46,9 @@ SECTIONS = ['part', 'chapter',
 
 # fixed elements -- always at level 1
 ELEMENTS = r'^\s*\\(begin\s*\{(document|abstract|thebibliography)\}|end\s*\{document\}|bibliography\s*\{)'
+# names of commands that can start fixed elements, must agree with ELEMENTS
+# None means any line that starts with \ can be a fixed element
+ELEMENTS_CMDS = ['begin', 'end', 'bibliography']
 
 # verbatim regions, headlines are ignored inside \begin{verbatim} ... \end{verbatim}
 VERBATIMS = ['verbatim', 'comment']
@@ -57,11 +60,13 @@ try:
         SECTIONS = vim.eval("g:voom_latex_sections")
     if vim.eval('exists("g:voom_latex_elements")')=='1':
         ELEMENTS = vim.eval("g:voom_latex_elements")
+        ELEMENTS_CMDS = None
     if vim.eval('exists("g:voom_latex_verbatims")')=='1':
         VERBATIMS = vim.eval("g:voom_latex_verbatims")
 except ImportError:
     pass
 import re
+import os
 
 # \section{head}  or  \section*{head}  or  \section[optionaltitle]{head}
 # NOTE: match leading whitespace to preserve it during outline operations
@@ -78,6 +83,39 @@ if VERBATIMS:
     VERBS_RE = re.compile(r'^\\begin\s*\{(%s)\}' %('|'.join(VERBATIMS))).match
 else:
     VERBS_RE = 0
+# {verbatim name: match function for its \end{...}, ...}, see get_verb_end()
+VERBS_ENDS = {}
+
+# Dispatch on the name of the command after \ to avoid matching all regexps
+# against every line that starts with \ .
+# NOTE: leading whitespace must be lstripped before matching
+CMD_RE = re.compile(r'\\([a-zA-Z]+)').match
+# Kinds of commands: section, \begin (verbatim or fixed element), fixed element.
+# Commands not in CMDS can be fixed elements only if ELEMENTS_CMDS is None.
+CMD_SECT, CMD_BEGIN, CMD_ELEM = 1, 2, 3
+CMDS = {}
+if ELEMS_RE:
+    if ELEMENTS_CMDS is None:
+        CMD_OTHER = CMD_ELEM
+    else:
+        CMD_OTHER = 0
+        for s in ELEMENTS_CMDS:
+            CMDS[s] = CMD_ELEM
+else:
+    CMD_OTHER = 0
+if VERBS_RE:
+    CMDS['begin'] = CMD_BEGIN
+for s in SECTIONS:
+    if s.isalpha():
+        CMDS[s] = CMD_SECT
+    # section name is a regexp or has non-letters, dispatch is not possible
+    else:
+        CMD_OTHER = CMD_SECT
+        break
+
+# \input{file}, \include{file}, \input file -- see makeProjectOutline()
+INPUT_CMDS = ('input', 'include')
+INPUT_RE = re.compile(r'\\(?:input|include)\s*(?:\{([^}]+)\}|\s(\S+))').match
 
 SECTIONS = ['\\'+s for s in SECTIONS]
 SECTS_LEVS = {} # {section: its default level, ...}
@@ -93,32 +131,71 @@ def hook_makeOutline(VO, blines):
     """Return (tlines, bnodes, levels) for Body lines blines.
     blines is either Vim buffer object (Body) or list of buffer lines.
     """
+    bnodes, levels, marks, heads, sects_levs = makeLists(blines)
+    levels, levs_sects = adjustLevels(levels, sects_levs)
+
+    # construct tlines
+    tlines = []
+    tlines_add = tlines.append
+    for i in xrange(len(levels)):
+        tlines_add(' %s%s|%s' %(marks[i], '. '*(levels[i]-1), heads[i]))
+
+    # save levs_sects for outline operations
+    # don't clobber VO.levs_sects when parsing clipboard during Paste
+    # which is the only time blines is not Body
+    if blines is VO.Body:
+        VO._levs_sects = levs_sects
+
+    return (tlines, bnodes, levels)
+
+
+def makeLists(blines, includes=None):
+    """Parse lines blines. Return (bnodes, levels, marks, heads, sects_levs).
+    levels are default levels of sections, see adjustLevels().
+    sects_levs is {section: its default level} for all sections found.
+    If includes is a list, append (lnum, file name) of each \input{...} and
+    \include{...} to it.
+    """
     Z = len(blines)
-    tlines, bnodes, levels = [], [], []
-    tlines_add, bnodes_add, levels_add = tlines.append, bnodes.append, levels.append
+    bnodes, levels = [], []
+    bnodes_add, levels_add = bnodes.append, levels.append
     marks, heads = [], []
     marks_add, heads_add = marks.append, heads.append
 
     sects_levs = {} # {section: its default level} for all section found in the buffer
-    inVerbatim = False
     isHead = False
     mark = ' ' # * or -
-    for i in xrange(Z):
-        L = blines[i].lstrip()
+    lnum = 0 # lnum of the current line
+    while lnum < Z:
+        L = blines[lnum].lstrip()
+        lnum += 1
         if not L.startswith('\\'): continue
+        m = CMD_RE(L)
+        if m:
+            cmd = CMDS.get(m.group(1), CMD_OTHER)
+            if includes is not None and m.group(1) in INPUT_CMDS:
+                mi = INPUT_RE(L)
+                if mi:
+                    includes.append((lnum, mi.group(1) or mi.group(2)))
+        else:
+            cmd = CMD_OTHER
+        if not cmd: continue
         # regions to ignore: \begin{verbatim} ... \end{verbatim}
-        if VERBS_RE:
-            if inVerbatim:
-                if re.match(inVerbatim, L):
-                    inVerbatim = False
+        # skip to the line after the matching \end{...}
+        if cmd==CMD_BEGIN:
+            m = VERBS_RE(L)
+            if m:
+                end_match = get_verb_end(m.group(1))
+                while lnum < Z:
+                    L = blines[lnum]
+                    lnum += 1
+                    if '\\end' in L and end_match(L.lstrip()): break
                 continue
-            else:
-                m = VERBS_RE(L)
-                if m:
-                    inVerbatim = r'\\end\s*\{%s\}' %m.group(1)
-                    continue
         # check for sections
-        m = SECTS_RE(L)
+        if cmd==CMD_SECT:
+            m = SECTS_RE(L)
+        else:
+            m = None
         if m:
             isHead = True
             s = '\\' + m.group(1)
@@ -146,15 +223,22 @@ def hook_makeOutline(VO, blines):
         # add node to outline
         if isHead:
             isHead = False
-            bnodes_add(i+1)
+            bnodes_add(lnum)
             levels_add(lev)
             # tlines must be constructed from marks and heads and after levels are adjusted
             marks_add(mark)
             mark = ' '
             heads_add(head)
 
-    # adjust default level numbers to reflect only sections present in the buffer
-    # that is make all level numbers continuous, top level is 1
+    return (bnodes, levels, marks, heads, sects_levs)
+
+
+def adjustLevels(levels, sects_levs):
+    """Adjust default level numbers to reflect only sections present in the
+    buffer, that is make all level numbers continuous, top level is 1.
+    Return (levels, levs_sects). levels is new list.
+    levs_sects is {actual level: section, ...}.
+    """
     d = {} # {default level: actual level, ...}
     levs_sects = {} # {actual level: section, ...}
     sects = [(sects_levs[s], s) for s in sects_levs.keys()]
@@ -166,18 +250,7 @@ def hook_makeOutline(VO, blines):
         levs_sects[i] = s
         i+=1
     levels = [d.get(i,i) for i in levels]
-
-    # construct tlines
-    for i in xrange(len(levels)):
-        tlines_add(' %s%s|%s' %(marks[i], '. '*(levels[i]-1), heads[i]))
-
-    # save levs_sects for outline operations
-    # don't clobber VO.levs_sects when parsing clipboard during Paste
-    # which is the only time blines is not Body
-    if blines is VO.Body:
-        VO._levs_sects = levs_sects
-
-    return (tlines, bnodes, levels)
+    return (levels, levs_sects)
 
 
 def hook_newHeadline(VO, level, blnum, tlnum):
@@ -278,6 +351,16 @@ def hook_doBodyAfterOop(VO, oop, levDelta, blnum1, tlnum1, blnum2, tlnum2, blnum
             vim.command("call voom#ErrorMsg('              level set to maximum for nodes: %s')" %invalid_sects)
 
 
+def get_verb_end(verb):
+    """Return match function for the end of verbatim region verb.
+    Compiled regexps are cached.
+    """
+    end_match = VERBS_ENDS.get(verb)
+    if not end_match:
+        end_match = VERBS_ENDS[verb] = re.compile(r'\\end\s*\{%s\}' %verb).match
+    return end_match
+
+
 def get_sect_for_lev(levs_sects, level):
     """Return (section, actual level) corresponding to the desired level.
     levs_sects contains all sections currently in use.
@@ -305,3 +388,115 @@ def get_sect_for_lev(levs_sects, level):
         return (SECTIONS[-1], level-(idx-z))
 
 
+#---Project outline--------------------------------------------------
+# Outline of a LaTeX project: the master file and all files included with
+# \input and \include, recursively. Each file is parsed by makeLists(). Results
+# are cached for each file and are reused while the file is unchanged: Vim
+# buffer's b:changedtick if the file is loaded in Vim, otherwise file's mtime
+# and size.
+
+# {file path: (stamp, (bnodes, levels, marks, heads, sects_levs, includes)), ...}
+PROJECT_CACHE = {}
+
+def makeProjectOutline(master):
+    """Return list of nodes of LaTeX project with master file master:
+        [(file path, lnum, level, mark, head), ...]
+    Nodes are in document order. Level 0 and mark '!' is for an \input line
+    that could not be followed: file not found, unreadable, or circular.
+    """
+    master = os.path.normcase(os.path.abspath(master))
+    # {file path: bufnr} for all loaded Vim buffers
+    buffers = {}
+    for bnr, bname in vim.eval("map(filter(range(1,bufnr('$')), 'bufloaded(v:val) && bufname(v:val)!=#\"\"'), '[v:val, fnamemodify(bufname(v:val),\":p\")]')"):
+        buffers[os.path.normcase(bname)] = bnr
+    # included files are relative to directory of master file
+    root = os.path.dirname(master)
+    nodes = []
+    sects_levs = {}
+    if not projectAddFile(master, root, buffers, nodes, sects_levs, []):
+        return []
+    # adjust levels for sections present in all files
+    levels, levs_sects = adjustLevels([n[2] for n in nodes], sects_levs)
+    return [(n[0], n[1], levels[i], n[3], n[4]) for i,n in enumerate(nodes)]
+
+
+def projectAddFile(path, root, buffers, nodes, sects_levs, stack):
+    """Add nodes of file path and of files it includes to list nodes.
+    Return False if file could not be read.
+    """
+    data = projectGetLists(path, buffers)
+    if not data:
+        return False
+    bnodes, levels, marks, heads, sects_levs_, includes = data
+    sects_levs.update(sects_levs_)
+    stack.append(path)
+    # merge headlines and included files in line order
+    j, z = 0, len(includes)
+    for i in xrange(len(bnodes)):
+        while j < z and includes[j][0] < bnodes[i]:
+            projectAddInclude(path, includes[j], root, buffers, nodes, sects_levs, stack)
+            j+=1
+        nodes.append((path, bnodes[i], levels[i], marks[i], heads[i]))
+    while j < z:
+        projectAddInclude(path, includes[j], root, buffers, nodes, sects_levs, stack)
+        j+=1
+    stack.pop()
+    return True
+
+
+def projectAddInclude(path, include, root, buffers, nodes, sects_levs, stack):
+    """Add nodes of included file, include is (lnum, name) from file path."""
+    lnum, name = include
+    name = os.path.expanduser(name.strip())
+    if not os.path.isabs(name):
+        name = os.path.join(root, name)
+    # \input{chapter} is chapter.tex or chapter
+    if name.endswith('.tex'):
+        names = [name]
+    else:
+        names = [name+'.tex', name]
+    for f in names:
+        f = os.path.normcase(os.path.abspath(f))
+        if f in buffers or os.path.isfile(f):
+            break
+    else:
+        nodes.append((path, lnum, 0, '!', 'file not found: %s' %include[1]))
+        return
+    if f in stack:
+        nodes.append((path, lnum, 0, '!', 'circular include: %s' %include[1]))
+    elif not projectAddFile(f, root, buffers, nodes, sects_levs, stack):
+        nodes.append((path, lnum, 0, '!', 'cannot read file: %s' %include[1]))
+
+
+def projectGetLists(path, buffers):
+    """Return cached or new makeLists() results plus includes for file path.
+    Return None if file could not be read.
+    """
+    bnr = buffers.get(path)
+    if bnr:
+        stamp = ('b', bnr, vim.eval("getbufvar(%s,'changedtick')" %bnr))
+    else:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        stamp = ('f', st.st_mtime, st.st_size)
+    cached = PROJECT_CACHE.get(path)
+    if cached and cached[0]==stamp:
+        return cached[1]
+
+    if bnr:
+        blines = vim.eval("getbufline(%s,1,'$')" %bnr)
+    else:
+        try:
+            f = open(path, 'rb')
+            try:
+                blines = f.read().splitlines()
+            finally:
+                f.close()
+        except IOError:
+            return None
+    includes = []
+    data = makeLists(blines, includes) + (includes,)
+    PROJECT_CACHE[path] = (stamp, data)
+    return data
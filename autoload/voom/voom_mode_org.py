@@ -13,6 +13,9 @@ See |voom-mode-org|,  ../../doc/voom.txt#*voom-mode-org*
 import re
 headline_match = re.compile(r'^(\*+)\s').match
 
+# Headlines depend only on their own Body lines, see voom_vim.voom_Init().
+HEADS_CONTEXT_FREE = 1
+
 
 def hook_makeOutline(VO, blines):
     """Return (tlines, bnodes, levels) for Body lines blines.
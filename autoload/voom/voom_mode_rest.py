@@ -20,6 +20,8 @@ http://docs.python.org/documenting/rest.html#sections
 Python recommended styles:   ##  **  =  -  ^  "
 """
 
+import re
+
 # All valid section title adornment characters.
 AD_CHARS = """  ! " # $ % & ' ( ) * + , - . / : ; < = > ? @ [ \ ] ^ _ ` { | } ~  """
 AD_CHARS = AD_CHARS.split()
@@ -42,6 +44,31 @@ assert len(AD_STYLES)==64
 # convert AD_CHARS to dict for faster lookups
 AD_CHARS = {}.fromkeys(AD_CHARS)
 
+# Chars a blank line or an underline can start with: whitespace or adornment char.
+FIRST_CHARS = dict(AD_CHARS)
+FIRST_CHARS.update({}.fromkeys(' \t\n\r\f\v'))
+
+# Non-ASCII char. Length of ASCII string is known without decoding.
+NONASCII_SEARCH = re.compile(r'[\x80-\xff]').search
+
+# Cache of lengths of decoded non-ASCII headlines: {(string, enc): length, ...}
+ULENS = {}
+
+
+def ulen(s, enc):
+    """Return length of string s decoded from encoding enc.
+    Decoding is done only for non-ASCII strings, result is cached.
+    """
+    if not NONASCII_SEARCH(s):
+        return len(s)
+    k = (s, enc)
+    if k in ULENS:
+        return ULENS[k]
+    if len(ULENS) > 5000:
+        ULENS.clear()
+    n = ULENS[k] = len(s.decode(enc,'replace'))
+    return n
+
 
 def hook_makeOutline(VO, blines):
     """Return (tlines, bnodes, levels) for Body lines blines.
@@ -63,28 +90,38 @@ def hook_makeOutline(VO, blines):
     #  head  L2, blines[i-1] -- title line, not blank, <= than underline, can be inset only if overline
     # ------ L1, blines[i]   -- current line, always an underline
     # x y z
-    L1, L2, L3 = '','',''
 
     # An underline can be only the 2nd or 3rd line of a block after a blank
     # line or previous underline. Thus, index of the next underline must be ok or ok+1.
     ok = 1
-    isHead = False
+    # index of the underline of the previous headline
+    i_head = -1
     for i in xrange(Z):
-        L2, L3 = L1, L2
-        L1 = blines[i].rstrip()
+        L1 = blines[i]
+        # Quick check of the first char: most lines can't be blank or underline.
+        if L1 and not L1[0] in FIRST_CHARS:
+            if i > ok: ok = Z
+            continue
+        L1 = L1.rstrip()
         if not L1:
             ok = i+2
             continue
-        if i < ok or not L2:
+        if i < ok:
             continue
-        # At this point both the current line (underline) and previous line (title) are not blank.
-
         # current line must be an underline
         if not ((L1[0] in AD_CHARS) and L1.lstrip(L1[0])==''):
             if i > ok: ok = Z
             continue
+        # At this point the current line is an underline and previous line
+        # (title) is not blank.
+        L2 = blines[i-1].rstrip()
+        if i > 1 and i-2 != i_head:
+            L3 = blines[i-2].rstrip()
+        else:
+            L3 = ''
+
         # underline must be as long as headline text
-        if len(L1) < len(L2.decode(ENC,'replace')):
+        if len(L1) < len(L2) and len(L1) < ulen(L2, ENC):
             if i > ok: ok = Z
             continue
         head = L2.lstrip()
@@ -94,32 +131,26 @@ def hook_makeOutline(VO, blines):
             continue
         # there is no overline; L3 must be blank line; L2 must be not inset
         if not L3 and len(L2)==len(head):
-            #if len(L1) < len(L2.decode(ENC,'replace')): continue
-            isHead = True
             ad = L1[0]
             bnode = i
         # there is overline -- bnode is lnum of overline!
         elif L3==L1:
-            #if len(L1) < len(L2.decode(ENC,'replace')): continue
-            isHead = True
             ad = L1[0]*2
             bnode = i-1
         else:
             if i > ok: ok = Z
             continue
 
-        if isHead:
-            if not ad in ads_levels:
-                ads_levels[ad] = len(ads_levels)+1
-            lev = ads_levels[ad]
-            isHead = False
-            L1, L2, L3 = '','',''
-            ok = i+2
+        if not ad in ads_levels:
+            ads_levels[ad] = len(ads_levels)+1
+        lev = ads_levels[ad]
+        i_head = i
+        ok = i+2
 
-            tline = '  %s|%s' %('. '*(lev-1), head)
-            tlines_add(tline)
-            bnodes_add(bnode)
-            levels_add(lev)
+        tline = '  %s|%s' %('. '*(lev-1), head)
+        tlines_add(tline)
+        bnodes_add(bnode)
+        levels_add(lev)
 
     # save ads_levels for outline operations
     # don't clobber VO.ads_levels when parsing clipboard during Paste
@@ -337,10 +368,10 @@ def deduce_ad_style(L1,L2,L3,ENC):
     # ----  L3      text  L3             Body[bln+1]
 
     # bnode is headline text, L2 is underline
-    if (L2[0] in AD_CHARS) and L2.lstrip(L2[0])=='' and (len(L2) >= len(L1.decode(ENC,'replace'))):
+    if (L2[0] in AD_CHARS) and L2.lstrip(L2[0])=='' and (len(L2) >= len(L1) or len(L2) >= ulen(L1, ENC)):
         ad = L2[0]
     # bnode is overline
-    elif L1==L3 and (L1[0] in AD_CHARS) and L1.lstrip(L1[0])=='' and (len(L1) >= len(L2.decode(ENC,'replace'))):
+    elif L1==L3 and (L1[0] in AD_CHARS) and L1.lstrip(L1[0])=='' and (len(L1) >= len(L2) or len(L1) >= ulen(L2, ENC)):
         ad = 2*L1[0]
     else:
         print L1
@@ -23,6 +23,9 @@ import re
 comment_tag_sub = re.compile('<!--.*?-->\s*$').sub
 headline_match = re.compile(r'^(=+).*(\1)\s*$').match
 
+# Headlines depend only on their own Body lines, see voom_vim.voom_Init().
+HEADS_CONTEXT_FREE = 1
+
 
 def hook_makeOutline(VO, blines):
     """Return (tlines, bnodes, levels) for Body lines blines.
@@ -12,8 +12,12 @@ import vim
 import sys, os, re
 import traceback
 import bisect
+import time
 # lazy imports
 shuffle = None # random.shuffle
+md5 = None # hashlib.md5
+ast = None
+threading = None
 
 #Vim = sys.modules['__main__']
 
@@ -33,32 +37,70 @@ MAKE_HEAD = {}
 # default start fold marker string and regexp
 MARKER = '{{{'                            #}}}
 MARKER_RE = re.compile(r'{{{(\d+)(x?)')   #}}}
+# start fold marker regexps: {marker: compiled regexp, ...}, see markerRe()
+MARKER_RES = {MARKER: MARKER_RE}
+
+# Vim settings used below, obtained with one vim.eval().
+# 'g' is {name: [value of g:voom_{name}] if it exists, [] otherwise, ...}
+_VIMVARS = vim.eval("{'g': map({'ft_modes':0, 'default_mode':0, 'clipboard_register':0, "
+                    "'always_allow_move_left':0, 'exec_persistent':0}, "
+                    "'exists(\"g:voom_\".v:key) ? [g:voom_{v:key}] : []'), "
+                    "'clipboard': has('clipboard'), "
+                    "'setreg': v:version > 704 || (v:version==704 && has('patch243')), "
+                    "'bindeval': v:version >= 704}")
+_G = _VIMVARS['g']
 
 # {'markdown': 'markdown', 'tex': 'latex', ...}
-if vim.eval("exists('g:voom_ft_modes')")=='1':
-    FT_MODES = vim.eval('g:voom_ft_modes')
+if _G['ft_modes']:
+    FT_MODES = _G['ft_modes'][0]
 else:
     FT_MODES = {}
 # default markup mode
-if vim.eval("exists('g:voom_default_mode')")=='1':
-    MODE = vim.eval('g:voom_default_mode')
+if _G['default_mode']:
+    MODE = _G['default_mode'][0]
 else:
     MODE = ''
 
 # which Vim register to use for copy/cut/paste operations
-if vim.eval("exists('g:voom_clipboard_register')")=='1':
-    CLIP = vim.eval('g:voom_clipboard_register')
-elif vim.eval("has('clipboard')")=='1':
+if _G['clipboard_register']:
+    CLIP = _G['clipboard_register'][0]
+elif _VIMVARS['clipboard']=='1':
     CLIP = '+'
 else:
     CLIP = 'o'
 
+# Vim functions setreg() and getreg() as Python callables, used by
+# setClipboard(). Need vim.Function and setreg() that accepts a list.
+if hasattr(vim, 'Function') and _VIMVARS['setreg']=='1':
+    VIM_SETREG, VIM_GETREG = vim.Function('setreg'), vim.Function('getreg')
+else:
+    VIM_SETREG = VIM_GETREG = None
+
+# Tree 'foldexpr' values are kept in Vim list b:voom_fde, which is modified
+# in place from Python, see treeSetLines(). Need vim.bindeval() and slice
+# assignment to vim.List.
+VIM_BINDEVAL = hasattr(vim, 'bindeval') and _VIMVARS['bindeval']=='1'
+
 # allow/disallow Move Left when nodes are not at the end of their subtree
-if vim.eval("exists('g:voom_always_allow_move_left')")=='1':
-    AAMLEFT = int(vim.eval('g:voom_always_allow_move_left'))
+if _G['always_allow_move_left']:
+    AAMLEFT = int(_G['always_allow_move_left'][0])
 else:
     AAMLEFT = 0
 
+# Voomexec executes Python scripts in persistent per-buffer namespace
+if _G['exec_persistent']:
+    EXEC_PERSISTENT = int(_G['exec_persistent'][0])
+else:
+    EXEC_PERSISTENT = 0
+
+del _VIMVARS, _G
+
+# Body options and variables needed by voom_Init(), obtained with one
+# vim.eval(). 'rstrip' is [g:voom_rstrip_chars_{&ft}] if it exists, [] otherwise.
+INIT_EVAL = ("{'bnr': bufnr(''), 'firstLine': l:firstLine, 'qargs': l:qargs, "
+             "'ft': &ft, 'enc': &enc, 'fmr': &fmr, 'cms': &cms, "
+             "'rstrip': exists('g:voom_rstrip_chars_'.&ft) ? [g:voom_rstrip_chars_{&ft}] : []}")
+
 
 #---Outline Construction----------------------{{{1o
 
@@ -68,10 +110,12 @@ class VoomOutline: #{{{2
     Instantiated from Body by voom#Init().
     """
     def __init__(self,body):
-        assert body == int(vim.eval("bufnr('')"))
+        pass
 
 
 def voom_Init(body): #{{{2
+    S = vim.eval(INIT_EVAL)
+    assert body == int(S['bnr'])
     VO = VoomOutline(body)
     VO.bnodes = [] # Body lnums of headlines
     VO.levels = [] # headline levels
@@ -79,30 +123,37 @@ def voom_Init(body): #{{{2
     VO.Body = vim.current.buffer
     VO.tree = None # will set later
     VO.Tree = None # will set later
+    VO.fde = None # b:voom_fde of Tree, will set later if possible
     VO.snLn = 1 # will change later if different
+    # Tree lnums [ln1, ln2] changed by outline operations since the last
+    # verification or outline update, see voom_OopVerify()
+    VO.oopRange = None
+    # parents and siblings of nodes, see navIndex()
+    VO.navIndex = None
+    # 'x', 'o', '=' flags of nodes made by fold marker parser and Body
+    # changedtick of the parse, see fmrFlags()
+    VO.fmrFlags = None
+    VO.fmrFlagsTick = None
     # first Tree line is Body buffer name and path
-    VO.bname = vim.eval('l:firstLine')
+    VO.bname = S['firstLine']
     # Body &filetype
-    VO.filetype = vim.eval('&filetype')
-    VO.enc = get_vim_encoding()
+    VO.filetype = S['ft']
+    VO.enc = get_vim_encoding(S['enc'])
 
     # start fold marker string and regexp (default and 'fmr' modes)
-    marker = vim.eval('&foldmarker').split(',')[0]
+    marker = S['fmr'].split(',')[0]
     VO.marker = marker
-    if marker==MARKER:
-        VO.marker_re = MARKER_RE
-    else:
-        VO.marker_re = re.compile(re.escape(marker) + r'(\d+)(x?)')
+    VO.marker_re = markerRe(marker)
 
     # chars to strip from right side of Tree headlines (default and 'fmr' modes)
-    if vim.eval("exists('g:voom_rstrip_chars_{&ft}')")=="1":
-        VO.rstrip_chars = vim.eval("g:voom_rstrip_chars_{&ft}")
+    if S['rstrip']:
+        VO.rstrip_chars = S['rstrip'][0]
     else:
-        VO.rstrip_chars = vim.eval("&commentstring").split('%s')[0].strip() + " \t"
+        VO.rstrip_chars = S['cms'].split('%s')[0].strip() + " \t"
 
     ### get markup mode, l:qargs is mode's name ###
     mModule = 0
-    mmode = vim.eval('l:qargs').strip() or FT_MODES.get(VO.filetype, MODE)
+    mmode = S['qargs'].strip() or FT_MODES.get(VO.filetype, MODE)
     if mmode:
         mName = 'voom_mode_%s' %mmode
         try:
@@ -126,6 +177,7 @@ def voom_Init(body): #{{{2
         VO.newHeadline = newHeadline
         VO.changeLevBodyHead = changeLevBodyHead
         VO.hook_doBodyAfterOop = 0
+        VO.headsContextFree = 1
     # markup mode for fold markers, similar to the default behavior
     elif getattr(mModule,'MTYPE',1)==0:
         VO.MTYPE = 0
@@ -139,6 +191,7 @@ def voom_Init(body): #{{{2
         VO.newHeadline = getattr(mModule,'hook_newHeadline',0) or newHeadline
         VO.changeLevBodyHead = changeLevBodyHead
         VO.hook_doBodyAfterOop = 0
+        VO.headsContextFree = getattr(mModule,'HEADS_CONTEXT_FREE',0)
     # markup mode not for fold markers
     else:
         VO.MTYPE = 1
@@ -147,12 +200,24 @@ def voom_Init(body): #{{{2
         # These must be False if not defined by the markup mode.
         VO.changeLevBodyHead = getattr(mModule,'hook_changeLevBodyHead',0)
         VO.hook_doBodyAfterOop = getattr(mModule,'hook_doBodyAfterOop',0)
+        # True if headlines and levels depend only on their own Body lines,
+        # never on preceding Body lines (fenced code blocks, etc.). Only then
+        # can some nodes be reparsed without parsing the rest of Body.
+        # Markup modes opt in with module constant HEADS_CONTEXT_FREE.
+        VO.headsContextFree = not VO.hook_doBodyAfterOop and getattr(mModule,'HEADS_CONTEXT_FREE',0)
 
     ### the end ###
     vim.command('let l:MTYPE=%s' %VO.MTYPE)
     VOOMS[body] = VO
 
 
+def markerRe(marker): #{{{2
+    """Return compiled regexp for start fold marker string marker."""
+    if not marker in MARKER_RES:
+        MARKER_RES[marker] = re.compile(re.escape(marker) + r'(\d+)(x?)')
+    return MARKER_RES[marker]
+
+
 def voom_TreeCreate(): #{{{2
     """This is part of voom#TreeCreate(), called from Tree."""
     body = int(vim.eval('a:body'))
@@ -166,7 +231,6 @@ def voom_TreeCreate(): #{{{2
         return
 
     bnodes = VO.bnodes
-    Body = VO.Body
     z = len(bnodes)
 
     ### compute snLn, create Tree folding
@@ -174,20 +238,15 @@ def voom_TreeCreate(): #{{{2
     # find bnode marked with '='
     # find bnodes marked with 'o'
     snLn = 0
-    marker_re = VO.marker_re
-    marker_re_search = marker_re.search
     oFolds = []
+    flags = fmrFlags(VO)
     for i in xrange(1,z):
-        bline = Body[bnodes[i]-1]
-        # part of Body headline after marker+level+'x'
-        bline2 = bline[marker_re_search(bline).end():]
-        if not bline2: continue
-        if bline2[0]=='=':
+        f = flags[i]
+        if not f&6: continue
+        if f&4:
             snLn = i+1
-        elif bline2[0]=='o':
+        if f&2:
             oFolds.append(i+1)
-            if bline2[1:] and bline2[1]=='=':
-                snLn = i+1
 
     # create Tree folding
     if oFolds:
@@ -223,6 +282,8 @@ def makeOutline(VO, blines): #{{{2
     Z = len(blines)
     tlines, bnodes, levels = [], [], []
     tlines_add, bnodes_add, levels_add = tlines.append, bnodes.append, levels.append
+    flags = bytearray(1) # see fmrFlags()
+    flags_add = flags.append
     c = VO.rstrip_chars
     for i in xrange(Z):
         if not marker in blines[i]: continue
@@ -231,10 +292,23 @@ def makeOutline(VO, blines): #{{{2
         if not m: continue
         lev = int(m.group(1))
         head = bline[:m.start()].lstrip().rstrip(c).strip('-=~').strip()
-        tline = ' %s%s|%s' %(m.group(2) or ' ', '. '*(lev-1), head)
+        x = m.group(2)
+        tline = ' %s%s|%s' %(x or ' ', '. '*(lev-1), head)
         tlines_add(tline)
         bnodes_add(i+1)
         levels_add(lev)
+        # node flags: 1 'x', 2 'o', 4 '=' after marker+level
+        f = x and 1 or 0
+        s = bline[m.end():m.end()+2]
+        if s:
+            if s[0]=='o':
+                f |= 2
+                if s[1:]=='=': f |= 4
+            elif s[0]=='=':
+                f |= 4
+        flags_add(f)
+    if blines is VO.Body:
+        VO.fmrFlags = flags
     return (tlines, bnodes, levels)
 
 
@@ -248,6 +322,8 @@ def makeOutlineH(VO, blines): #{{{2
     Z = len(blines)
     tlines, bnodes, levels = [], [], []
     tlines_add, bnodes_add, levels_add = tlines.append, bnodes.append, levels.append
+    flags = bytearray(1) # see fmrFlags()
+    flags_add = flags.append
     h = MAKE_HEAD[VO.filetype]
     for i in xrange(Z):
         if not marker in blines[i]: continue
@@ -256,13 +332,63 @@ def makeOutlineH(VO, blines): #{{{2
         if not m: continue
         lev = int(m.group(1))
         head = h(bline,m)
-        tline = ' %s%s|%s' %(m.group(2) or ' ', '. '*(lev-1), head)
+        x = m.group(2)
+        tline = ' %s%s|%s' %(x or ' ', '. '*(lev-1), head)
         tlines_add(tline)
         bnodes_add(i+1)
         levels_add(lev)
+        # node flags: 1 'x', 2 'o', 4 '=' after marker+level
+        f = x and 1 or 0
+        s = bline[m.end():m.end()+2]
+        if s:
+            if s[0]=='o':
+                f |= 2
+                if s[1:]=='=': f |= 4
+            elif s[0]=='=':
+                f |= 4
+        flags_add(f)
+    if blines is VO.Body:
+        VO.fmrFlags = flags
     return (tlines, bnodes, levels)
 
 
+def fmrFlags(VO): #{{{2
+    """Return bytearray of 'x', 'o', '=' flags of nodes in fmr outline. Item i
+    is for Tree line i+1: 1 if headline is marked with 'x', 2 if marked with
+    'o', 4 if marked with '='. Flags made by the last outline update are
+    reused if Body has not changed since then. Otherwise Body headlines are
+    parsed again.
+    """
+    tick = vim.eval("getbufvar(%s,'changedtick')" %VO.body)
+    flags = VO.fmrFlags
+    if tick and tick==VO.fmrFlagsTick and flags and len(flags)==len(VO.bnodes):
+        return flags
+    Body = VO.Body
+    marker_re_search = VO.marker_re.search
+    flags = bytearray(1)
+    for bln in VO.bnodes[1:]:
+        bline = Body[bln-1]
+        flags.append(headFlags(bline, marker_re_search(bline)))
+    VO.fmrFlags, VO.fmrFlagsTick = flags, tick
+    return flags
+
+
+def headFlags(bline, m): #{{{2
+    """Return flags of Body headline bline, see fmrFlags().
+    m is fold marker match object.
+    """
+    # NOTE: duplicate code in makeOutline(), makeOutlineH() and fmr modes
+    f = m.group(2) and 1 or 0
+    s = bline[m.end():m.end()+2]
+    if s:
+        if s[0]=='o':
+            f |= 2
+            if s[1:]=='=': f |= 4
+        elif s[0]=='=':
+            f |= 4
+    return f
+
+
 #--- make_head functions --- {{{2
 
 def make_head_html(bline,match):
@@ -292,9 +418,15 @@ def updateTree(body,tree): #{{{2
     VO = VOOMS[body]
     assert VO.tree == tree
     #blines = VO.Body[:] # wasteful, see v3.0 notes
+    VO.fmrFlags = None
     tlines, bnodes, levels  = VO.makeOutline(VO, VO.Body)
     tlines[0:0], bnodes[0:0], levels[0:0] = [VO.bname], [1], [1]
     VO.bnodes, VO.levels = bnodes, levels
+    # fold marker parsers set VO.fmrFlags
+    if VO.fmrFlags is not None:
+        VO.fmrFlagsTick = vim.eval("getbufvar(%s,'changedtick')" %body)
+    VO.oopRange = None
+    VO.navIndex = None
 
     ### Add the = mark.
     snLn = VO.snLn
@@ -315,7 +447,7 @@ def updateTree(body,tree): #{{{2
     Tree = VO.Tree
     #tlines_ = Tree[:]
     if not len(Tree)==len(tlines):
-        Tree[:] = tlines
+        treeSetLines(VO, 0, len(Tree), tlines)
         vim.command('let l:ok=1')
         return
 
@@ -330,16 +462,62 @@ def updateTree(body,tree): #{{{2
                 draw_one = True
                 diff = i
             else:
-                Tree[diff:] = tlines[diff:]
+                treeSetLines(VO, diff, len(Tree), tlines[diff:])
                 vim.command('let l:ok=1')
                 return
     if draw_one:
-        Tree[diff] = tlines[diff]
+        treeSetLines(VO, diff, diff+1, [tlines[diff]])
 
     vim.command('let l:ok=1')
     # why l:ok is needed:  ../../doc/voom.txt#id_20110213212708
 
 
+def treeFdeInit(body): #{{{2
+    """Create Tree buffer var b:voom_fde, list of 'foldexpr' values of Tree
+    lines, and bind it to VO.fde. Tree must be the current buffer.
+    """
+    if not VIM_BINDEVAL: return
+    VO = VOOMS[body]
+    vim.command('let b:voom_fde = []')
+    VO.fde = vim.bindeval('b:voom_fde')
+    tlines = VO.Tree[:]
+    inds = [treeInd(t) for t in tlines] + [0]
+    VO.fde.extend([treeFde(inds[i], inds[i+1]) for i in xrange(len(tlines))])
+
+
+def treeInd(tline): #{{{2
+    """Return fold level of Tree line tline, same as voom#TreeFoldexpr()."""
+    return max(tline.find('|'), 0)//2
+
+
+def treeFde(ind, indn): #{{{2
+    """Return 'foldexpr' value of Tree line with fold level ind followed by
+    Tree line with fold level indn, same as voom#TreeFoldexpr().
+    """
+    if indn > ind:
+        return '>%s' %ind
+    return ind-1
+
+
+def treeSetLines(VO, i, j, tlines): #{{{2
+    """Set Tree lines: Tree[i:j] = tlines. Update 'foldexpr' values in VO.fde
+    first: Vim evaluates 'foldexpr' of changed lines when Tree is modified.
+    """
+    Tree, fde = VO.Tree, VO.fde
+    if fde is not None:
+        # fold levels of new lines and of the line after them
+        inds = [treeInd(t) for t in tlines]
+        if j < len(Tree):
+            inds.append(treeInd(Tree[j]))
+        else:
+            inds.append(0)
+        # value of the line before new lines depends on the first new line
+        if i > 0:
+            fde[i-1] = treeFde(treeInd(Tree[i-1]), inds[0])
+        fde[i:j] = [treeFde(inds[k], inds[k+1]) for k in xrange(len(tlines))]
+    Tree[i:j] = tlines
+
+
 def computeSnLn(body, blnr): #{{{2
     """Compute Tree lnum for node at line blnr in Body body.
     Assign Vim and Python snLn vars.
@@ -353,6 +531,7 @@ def computeSnLn(body, blnr): #{{{2
 
 def voom_UnVoom(body): #{{{2
     if body in VOOMS: del VOOMS[body]
+    execFree(body)
 
 
 def voom_Voominfo(): #{{{2
@@ -534,6 +713,38 @@ def getSiblingsGroups(VO, siblings): #{{{2
     return results
 
 
+def navIndex(VO): #{{{2
+    """Return (parents, siblings, positions) for all nodes. Item i is for
+    node at Tree line i+1: Tree lnum of parent (1 for top level nodes), list
+    of Tree lnums of siblings (nodes with the same parent and level), and
+    index of node in that list. Tree line 1 has no parent and siblings.
+    The lists are cached in VO.navIndex until outline changes.
+    """
+    levels = VO.levels
+    if VO.navIndex and len(VO.navIndex[0])==len(levels):
+        return VO.navIndex
+    z = len(levels)
+    parents, siblings, positions = [0]*z, [None]*z, [0]*z
+    groups = {}
+    # Tree lnums and levels of current node and its ancestors
+    stack, stack_levs = [1], [0]
+    for i in xrange(1,z):
+        lev = levels[i]
+        while stack_levs[-1] >= lev:
+            stack.pop()
+            stack_levs.pop()
+        p = stack[-1]
+        sibs = groups.get((p,lev))
+        if sibs is None:
+            sibs = groups[(p,lev)] = []
+        parents[i], siblings[i], positions[i] = p, sibs, len(sibs)
+        sibs.append(i+1)
+        stack.append(i+1)
+        stack_levs.append(lev)
+    VO.navIndex = (parents, siblings, positions)
+    return VO.navIndex
+
+
 def nodesBodyRange(VO, ln1, ln2, withSubnodes=False): #{{{2
     """Return Body start and end lnums (bln1, bln2) corresponding to nodes at
     Tree lnums ln1 to ln2. Include ln2's subnodes if withSubnodes."""
@@ -568,25 +779,39 @@ def voom_TreeSelect(): #{{{2
     # In that case VO.bnodes is [1, 1, ...] and (l:blnum1,l:blnum2) is (1,0)
 
 
+def voom_TreeNav(): #{{{2
+    """Compute Tree lnum of node to go to from node at Tree line l:lnum.
+    l:action is: U or D -- first or last sibling; K or J -- l:vcount1-th
+    previous or next sibling, or the farthest one; P -- parent.
+    """
+    body = int(vim.eval('l:body'))
+    lnum = int(vim.eval('l:lnum'))
+    action = vim.eval('l:action')
+    VO = VOOMS[body]
+    if lnum==1: return
+    parents, siblings, positions = navIndex(VO)
+    sibs, pos = siblings[lnum-1], positions[lnum-1]
+    if action=='U':
+        lnum = sibs[0]
+    elif action=='D':
+        lnum = sibs[-1]
+    elif action=='K':
+        lnum = sibs[max(pos-int(vim.eval('l:vcount1')), 0)]
+    elif action=='J':
+        lnum = sibs[min(pos+int(vim.eval('l:vcount1')), len(sibs)-1)]
+    elif action=='P':
+        lnum = parents[lnum-1]
+        # top level node, do not go anywhere
+        if lnum==1: return
+    vim.command('let l:lnum=%s' %lnum)
+
+
 def voom_TreeToStartupNode(): #{{{2
     body = int(vim.eval('l:body'))
     VO = VOOMS[body]
-    bnodes = VO.bnodes
-    Body = VO.Body
-    marker_re = VO.marker_re
-    z = len(bnodes)
     # find Body headlines marked with '='
-    lnums = []
-    for i in xrange(1,z):
-        bline = Body[bnodes[i]-1]
-        # part of Body headline after marker+level+'x'+'o'
-        bline2 = bline[marker_re.search(bline).end():]
-        if not bline2: continue
-        if bline2[0]=='=':
-            lnums.append(i+1)
-        elif bline2[0]=='o':
-            if bline2[1:] and bline2[1]=='=':
-                lnums.append(i+1)
+    flags = fmrFlags(VO)
+    lnums = [i+1 for i in xrange(1,len(flags)) if flags[i]&4]
     vim.command('let l:lnums=%s' %repr(lnums))
 
 
@@ -613,28 +838,50 @@ def voom_EchoUNL(): #{{{2
     vim.command("echon '%s'" %(heads[-1].replace("'", "''")))
 
 
-def voom_Grep(): #{{{2
+# State of :Voomgrep search in progress, see voom_GrepStart().
+GREP = None
+
+
+def voom_GrepStart(): #{{{2
+    """Start new :Voomgrep search in Body l:body."""
+    global GREP
     body = int(vim.eval('l:body'))
-    tree = int(vim.eval('l:tree'))
-    VO = VOOMS[body]
-    assert VO.tree == tree
+    GREP = {'VO': VOOMS[body],
+            'AND': [], # list of AND "tlnums" dicts
+            'NOT': [], # list of NOT "tlnums" dicts
+            'counts': {}, # {tlnum: count of all AND matches in this node, ...}
+            'blnums': {}, # {tlnum: blnum of first AND match in this node, ...}
+            'inh_only': {}, # tlnums of nodes added to an AND match by inheritance only
+            'tln': 0, # tlnum of the last match
+            }
+
+
+def voom_GrepAdd(): #{{{2
+    """Add Body lnums of matches l:matches (a batch, in ascending order) for
+    the current :Voomgrep pattern. Called by voom#GrepSearch() for each batch.
+    l:first is 1 for the first batch of a pattern, l:done is 1 for the last.
+    l:kind is 'AND' or 'NOT', l:inh is 1 if search is hierarchical.
+    Matches are converted into tlnums (node numbers) and counted as they come,
+    so the number of matches is not limited.
+    """
+    matches = vim.eval('l:matches')
+    kind = vim.eval('l:kind')
+    if vim.eval('l:first')=='1':
+        # {tlnum of node with a match:0, ...}
+        GREP[kind].append({})
+        GREP['tln'] = 0
+    VO = GREP['VO']
     bnodes = VO.bnodes
-    matchesAND, matchesNOT = vim.eval('l:matchesAND'), vim.eval('l:matchesNOT')
-    inhAND, inhNOT = vim.eval('l:inhAND'), vim.eval('l:inhNOT')
-
-    # Convert blnums of mathes into tlnums, that is node numbers.
-    tlnumsAND, tlnumsNOT = [], [] # lists of AND and NOT "tlnums" dicts
-
-    # Process AND matches.
-    counts = {} # {tlnum: count of all AND matches in this node, ...}
-    blnums = {} # {tlnum: blnum of first AND match in this node, ...}
-    inh_only = {} # tlnums of nodes added to an AND match by inheritance only
-    idx = 0 # index into matchesAND and inhAND
-    for L in matchesAND:
-        tlnums = {} # {tlnum of node with a match:0, ...}
-        for bln in L:
+    z = len(bnodes)
+    tlnums = GREP[kind][-1]
+    counts, blnums = GREP['counts'], GREP['blnums']
+    # Matches are in ascending order: tln is bisect.bisect_right(bnodes, bln)
+    tln = GREP['tln']
+    if kind=='AND':
+        for bln in matches:
             bln = int(bln)
-            tln = bisect.bisect_right(bnodes, bln)
+            while tln < z and bnodes[tln] <= bln:
+                tln+=1
             tlnums[tln] = 0
             if tln in counts:
                 counts[tln]+=1
@@ -644,41 +891,48 @@ def voom_Grep(): #{{{2
                 blnums[tln] = bln
             elif blnums[tln] > bln or counts[tln]==1:
                 blnums[tln] = bln
-        # inheritace: add subnodes for each node with a match
-        if int(inhAND[idx]):
-            ks = tlnums.keys()
-            for t in ks:
-                subn = nodeSubnodes(VO,t)
-                for s in xrange(t+1,t+subn+1):
-                    if not s in tlnums:
-                        tlnums[s] = 0
-                        counts[s] = 0
-                        blnums[s] = bnodes[s-1]
-                        # node has no match, added thank to inheritance only
-                        inh_only[s] = 0
-        idx+=1
-        tlnumsAND.append(tlnums)
-
-    # Process NOT matches.
-    idx = 0 # index into matchesNOT and inhNOT
-    for L in matchesNOT:
-        tlnums = {} # {tlnum of node with a match:0, ...}
-        for bln in L:
+    else:
+        for bln in matches:
             bln = int(bln)
-            tln = bisect.bisect_right(bnodes, bln)
+            while tln < z and bnodes[tln] <= bln:
+                tln+=1
             tlnums[tln] = 0
-        # inheritace: add subnodes for each node with a match
-        if int(inhNOT[idx]):
-            ks = tlnums.keys()
-            for t in ks:
-                subn = nodeSubnodes(VO,t)
-                for s in xrange(t+1,t+subn+1):
-                    tlnums[s] = 0
-        idx+=1
-        tlnumsNOT.append(tlnums)
+    GREP['tln'] = tln
+
+    if vim.eval('l:done')=='0' or vim.eval('l:inh')=='0':
+        return
+    # inheritace: add subnodes for each node with a match
+    inh_only = GREP['inh_only']
+    ks = tlnums.keys()
+    for t in ks:
+        subn = nodeSubnodes(VO,t)
+        for s in xrange(t+1,t+subn+1):
+            if not s in tlnums:
+                tlnums[s] = 0
+                if kind=='AND':
+                    counts[s] = 0
+                    blnums[s] = bnodes[s-1]
+                    # node has no match, added thank to inheritance only
+                    inh_only[s] = 0
+
+
+def voom_Grep(): #{{{2
+    """Show results of :Voomgrep search: nodes with matches collected by
+    voom_GrepAdd().
+    """
+    global GREP
+    body = int(vim.eval('l:body'))
+    tree = int(vim.eval('l:tree'))
+    VO = VOOMS[body]
+    assert VO.tree == tree
+    bnodes = VO.bnodes
+    tlnumsAND, tlnumsNOT = GREP['AND'], GREP['NOT']
+    counts, blnums, inh_only = GREP['counts'], GREP['blnums'], GREP['inh_only']
+    GREP = None
 
     # There are only NOT patterns.
-    if not matchesAND:
+    onlyNOT = not tlnumsAND
+    if onlyNOT:
         tlnumsAND = [{}.fromkeys(range(1,len(bnodes)+1))]
 
     # Compute intersection.
@@ -693,7 +947,7 @@ def voom_Grep(): #{{{2
     max_size = 0
     for t in results:
         # there are only NOT patterns
-        if not matchesAND:
+        if onlyNOT:
             blnums[t] = bnodes[t-1]
             counts[t] = 0
             nNs[t] = 'n'
@@ -751,6 +1005,21 @@ def intersectDicts(dictsAND, dictsNOT): #{{{2
     return res
 
 
+def voom_LatexProject(): #{{{2
+    """Add outline of LaTeX project with master file l:master to quickfix list."""
+    master = vim.eval('l:master')
+    mModule = __import__('voom_mode_latex')
+    nodes = mModule.makeProjectOutline(master)
+    # Make list of dictionaries for setqflist().
+    qflist = []
+    for (fname, lnum, lev, mark, head) in nodes:
+        text = ('%s%s|%s' %(mark, '. '*(lev-1), head)).replace("'", "''")
+        d = "{'text':'%s', 'lnum':%s, 'filename':'%s'}, " %(text, lnum, fname.replace("'", "''"))
+        qflist.append(d)
+    vim.command("call setqflist([%s],'a')" %(''.join(qflist)) )
+    vim.command('let l:nodes=%s' %len(nodes))
+
+
 #---Outline Operations------------------------{{{1o
 # voom_Oop... functions are called from voom#Oop... Vim functions.
 # They use local Vim vars set by the caller and can create and change Vim vars.
@@ -775,6 +1044,58 @@ def setLevTreeLines(tlines, levels, j): #{{{2
     return results
 
 
+def swapLines(buf, i1, i2, i3, lines1=None, lines2=None, VO=None): #{{{2
+    """Swap adjacent ranges of lines buf[i1:i2] and buf[i2:i3] in Vim buffer
+    or list buf. lines1 or lines2 is new content of the first or second range
+    if it must be changed too. Only lines of one range are moved: the range
+    with new content or else the range with fewer lines.
+    If buf is Tree, VO must be given, see treeSetLines().
+    """
+    if VO is None:
+        def setLines(i, j, lines): buf[i:j] = lines
+    else:
+        def setLines(i, j, lines): treeSetLines(VO, i, j, lines)
+    if lines1 is not None or (lines2 is None and i2-i1 <= i3-i2):
+        # move first range after second range: insert, then delete
+        if lines1 is None: lines1 = buf[i1:i2]
+        setLines(i3, i3, lines1)
+        setLines(i1, i2, [])
+    else:
+        # move second range before first range: delete, then insert
+        if lines2 is None: lines2 = buf[i2:i3]
+        setLines(i2, i3, [])
+        setLines(i1, i1, lines2)
+
+
+def setBufLines(buf, lines): #{{{2
+    """Set lines of Vim buffer or list buf. lines is dict {lnum: new line}.
+    Each run of consecutive lnums is set with one slice assignment.
+    """
+    lnums = sorted(lines)
+    i, z = 0, len(lnums)
+    while i < z:
+        j = i+1
+        while j < z and lnums[j]==lnums[j-1]+1:
+            j+=1
+        buf[lnums[i]-1:lnums[j-1]] = [lines[ln] for ln in lnums[i:j]]
+        i = j
+
+
+def setBodyHeads(VO, heads): #{{{2
+    """Set Body headlines of fmr outline. heads is dict {Tree lnum: new Body
+    headline}. Update VO.fmrFlags of these nodes if they are up to date.
+    """
+    bnodes, flags = VO.bnodes, VO.fmrFlags
+    tick = vim.eval("getbufvar(%s,'changedtick')" %VO.body)
+    setBufLines(VO.Body, dict([(bnodes[ln-1], h) for ln, h in heads.iteritems()]))
+    if not (tick and tick==VO.fmrFlagsTick and flags and len(flags)==len(bnodes)):
+        return
+    marker_re_search = VO.marker_re.search
+    for ln, h in heads.iteritems():
+        flags[ln-1] = headFlags(h, marker_re_search(h))
+    VO.fmrFlagsTick = vim.eval("getbufvar(%s,'changedtick')" %VO.body)
+
+
 def changeLevBodyHead(VO, h, levDelta): #{{{2
     """Increase or decrease level number of Body headline by levDelta.
     NOTE: markup modes can replace this function with hook_changeLevBodyHead.
@@ -795,8 +1116,21 @@ def newHeadline(VO, level, blnum, ln): #{{{2
     return (tree_head, bodyLines)
 
 
-def setClipboard(s): #{{{2
-    """Set Vim register CLIP (usually +) to string s."""
+def setClipboard(blines): #{{{2
+    """Set Vim register CLIP (usually +) to list of lines blines, characterwise.
+    The same as setting it to string '\n'.join(blines).
+    """
+    # Setting the register with setreg() and a list of lines avoids making
+    # an escaped copy of the text and parsing it as a Vim string literal.
+    if VIM_SETREG:
+        VIM_SETREG(CLIP, blines, 'c')
+        # Check the number of lines in the register, see below why.
+        # getreg() with list argument doesn't join lines into one string.
+        if not len(VIM_GETREG(CLIP, 1, 1))==len(blines):
+            vim.command("call voom#ErrorMsg('VOoM: error setting clipboard')")
+        return
+
+    s = '\n'.join(blines)
     # important: use '' for Vim string
     vim.command("let @%s = '%s'" %(CLIP, s.replace("'", "''")))
 
@@ -808,12 +1142,100 @@ def setClipboard(s): #{{{2
         vim.command("call voom#ErrorMsg('VOoM: error setting clipboard')")
 
 
+# Outline of clipboard text set by the last Copy or Cut, or parsed by the last
+# Paste, to avoid parsing the same text again on Paste:
+# (md5 digest of text, mode signature, tlines, bnodes, levels)
+CLIP_OUTLINE = None
+
+
+def clipModeSig(VO): #{{{2
+    """Return a tuple that identifies how clipboard text is parsed."""
+    return (VO.makeOutline, VO.filetype, VO.enc, VO.marker, VO.rstrip_chars)
+
+
+def clipDigest(blines): #{{{2
+    """Return md5 digest of text '\n'.join(blines), computed line by line
+    to avoid making the text string.
+    """
+    global md5
+    if md5 is None: from hashlib import md5
+    h = md5()
+    update = h.update
+    if blines:
+        update(blines[0])
+        for bline in blines[1:]:
+            update('\n')
+            update(bline)
+    return h.digest()
+
+
+def setClipOutline(VO, blines, tlines, bnodes, levels): #{{{2
+    """Remember outline of clipboard text, Body lines of nodes blines.
+    bnodes are relative to the first line of blines. Lists are copied.
+    """
+    global CLIP_OUTLINE
+    CLIP_OUTLINE = (clipDigest(blines), clipModeSig(VO), tlines[:], bnodes[:], levels[:])
+
+
+def getClipOutline(VO, blines): #{{{2
+    """Return (tlines, bnodes, levels) for clipboard text, lines blines, if
+    it was saved by setClipOutline() for the same markup mode. Return None
+    otherwise.
+    """
+    if not CLIP_OUTLINE or CLIP_OUTLINE[1] != clipModeSig(VO):
+        return None
+    if CLIP_OUTLINE[0] != clipDigest(blines):
+        return None
+    return (CLIP_OUTLINE[2][:], CLIP_OUTLINE[3][:], CLIP_OUTLINE[4][:])
+
+
+def copyClipOutline(VO, blines, ln1, ln2): #{{{2
+    """Nodes ln1-ln2 were copied to clipboard as Body lines blines. Save their
+    outline if it is the same as what parsing blines would give: if headlines
+    don't depend on the preceding Body lines (VO.headsContextFree).
+    """
+    global CLIP_OUTLINE
+    CLIP_OUTLINE = None
+    if not VO.headsContextFree:
+        return
+    bnodes = VO.bnodes
+    d = bnodes[ln1-1]-1
+    # first char of Tree line is '=' if it is snLn
+    tlines = [' %s' %t[1:] for t in VO.Tree[ln1-1:ln2]]
+    setClipOutline(VO, blines, tlines, [(bn-d) for bn in bnodes[ln1-1:ln2]], VO.levels[ln1-1:ln2])
+
+
+def oopRangeAdd(VO, ln1, ln2, ln=0, delta=0): #{{{2
+    """Add Tree lines ln1-ln2 to VO.oopRange, Tree lines changed by outline
+    operations. If delta Tree lines were inserted (delta>0) or deleted
+    (delta<0) after line ln, VO.oopRange is adjusted first.
+    """
+    # outline changed: levels of nodes may be different
+    VO.navIndex = None
+    r = VO.oopRange
+    if r:
+        a, b = r
+        if delta:
+            if a > ln: a = max(ln, a+delta)
+            if b > ln: b = max(ln, b+delta)
+        ln1, ln2 = min(a,ln1), max(b,ln2)
+    VO.oopRange = [ln1, ln2]
+
+
 def voom_OopVerify(): #{{{2
     body, tree = int(vim.eval('a:body')), int(vim.eval('a:tree'))
     VO = VOOMS[body]
     assert VO.tree == tree
     ok = True
 
+    # Parse only Body lines of nodes changed by outline operations. Not
+    # possible if headlines can depend on preceding Body lines.
+    r, VO.oopRange = VO.oopRange, None
+    if r and VO.headsContextFree and vim.eval('l:full')=='0':
+        if oopVerifyRange(VO, r[0], r[1]):
+            vim.command("let l:ok=1")
+        return
+
     tlines, bnodes, levels  = VO.makeOutline(VO, VO.Body)
     if not len(VO.Tree)==len(tlines)+1:
         vim.command("call voom#ErrorMsg('VOoM: outline verification failed: wrong Tree size')")
@@ -839,6 +1261,46 @@ def voom_OopVerify(): #{{{2
         vim.command("let l:ok=1")
 
 
+def oopVerifyRange(VO, ln1, ln2): #{{{2
+    """Verify outline data of nodes at Tree lines ln1-ln2 and of one node
+    before and after them by parsing only Body lines of these nodes.
+    Return True if outline data are correct.
+    """
+    Body, Tree = VO.Body, VO.Tree
+    bnodes, levels = VO.bnodes, VO.levels
+    Z = len(bnodes)
+    if not len(Tree)==Z==len(levels) or bnodes[-1] > len(Body):
+        vim.command("call voom#ErrorMsg('VOoM: outline verification failed: wrong Tree size')")
+        vim.command("call voom#ErrorMsg('VOoM: OUTLINE MAY BE CORRUPT!!! YOU MUST UNDO THE LAST OPERATION!!!')")
+        return False
+    ln1, ln2 = max(ln1-1, 1), min(ln2+1, Z)
+    if ln1 > ln2: ln1 = ln2
+
+    # Body lines of nodes ln1-ln2; all lines before the first node if ln1 is 1
+    bln1 = bnodes[ln1-1]
+    if ln2 < Z: bln2 = bnodes[ln2]-1
+    else: bln2 = len(Body)
+    tlines, bnodes_, levels_ = VO.makeOutline(VO, Body[bln1-1:bln2])
+    bnodes_ = [(bln+bln1-1) for bln in bnodes_]
+    if ln1==1: ln1 = 2
+
+    if not bnodes[ln1-1:ln2] == bnodes_:
+        vim.command("call voom#ErrorMsg('VOoM: outline verification failed: wrong bnodes')")
+        vim.command("call voom#ErrorMsg('VOoM: OUTLINE MAY BE CORRUPT!!! YOU MUST UNDO THE LAST OPERATION!!!')")
+        return False
+    snLn = VO.snLn
+    if ln1 <= snLn <= ln2:
+        tlines[snLn-ln1] = '=%s' %tlines[snLn-ln1][1:]
+    ok = True
+    if not levels[ln1-1:ln2] == levels_:
+        ok = False
+        vim.command("call voom#ErrorMsg('VOoM: outline verification failed: wrong levels')")
+    if not (Tree[ln1-1:ln2] == tlines and Tree[snLn-1][:1] == '='):
+        ok = False
+        vim.command("call voom#ErrorMsg('VOoM: outline verification failed: wrong Tree lines')")
+    return ok
+
+
 def voom_OopSelEnd(): #{{{2
     """This is part of voom#Oop() checks.
     Selection in Tree starts at line ln1 and ends at line ln2.
@@ -922,8 +1384,9 @@ def voom_OopInsert(as_child=False): #{{{2
     tree_head, bodyLines = VO.newHeadline(VO,lev,bLnum,ln)
 
     treeLine = '= %s|%s' %('. '*(lev-1), tree_head)
-    Tree[ln:ln] = [treeLine]
+    treeSetLines(VO, ln, ln, [treeLine])
     Body[bLnum:bLnum] = bodyLines
+    oopRangeAdd(VO, ln+1, ln+1, ln, 1)
 
     vim.command('let l:bLnum=%s' %(bLnum+1))
 
@@ -944,7 +1407,8 @@ def voom_OopCopy(): #{{{2
     if ln2 < len(bnodes): bln2 = bnodes[ln2]-1
     else: bln2 = len(Body)
     blines = Body[bln1-1:bln2]
-    setClipboard('\n'.join(blines))
+    setClipboard(blines)
+    copyClipOutline(VO, blines, ln1, ln2)
 
 
 def voom_OopCut(): #{{{2
@@ -972,7 +1436,8 @@ def voom_OopCut(): #{{{2
     if ln2 < len(bnodes): bln2 = bnodes[ln2]-1
     else: bln2 = len(Body)
     blines = Body[bln1-1:bln2]
-    setClipboard('\n'.join(blines))
+    setClipboard(blines)
+    copyClipOutline(VO, blines, ln1, ln2)
     Body[bln1-1:bln2] = []
 
     blnShow = bnodes[lnUp1-1] # does not change
@@ -998,12 +1463,14 @@ def voom_OopCut(): #{{{2
     snLn = VO.snLn
     Tree[snLn-1] = ' ' + Tree[snLn-1][1:]
     ### delete range in Tree (same as in levels))
-    Tree[ln1-1:ln2] = []
+    treeSetLines(VO, ln1-1, ln2, [])
 
     ### add snLn mark
     Tree[lnUp1-1] = '=' + Tree[lnUp1-1][1:]
     VO.snLn = lnUp1
 
+    oopRangeAdd(VO, ln1-1, ln1, ln1-1, ln1-1-ln2)
+
     # do this last to tell vim script that there were no errors
     vim.command('let l:blnShow=%s' %blnShow)
 
@@ -1023,7 +1490,13 @@ def voom_OopPaste(): #{{{2
         vim.command("call voom#OopFromBody(%s,%s,-1)" %(body,tree))
         return
     pBlines = pText.split('\n') # Body lines to paste
-    pTlines, pBnodes, pLevels = VO.makeOutline(VO, pBlines)
+    # outline of clipboard text is known if it was copied or pasted last time
+    pOutline = getClipOutline(VO, pBlines)
+    if pOutline:
+        pTlines, pBnodes, pLevels = pOutline
+    else:
+        pTlines, pBnodes, pLevels = VO.makeOutline(VO, pBlines)
+        setClipOutline(VO, pBlines, pTlines, pBnodes, pLevels)
 
     ### verify that clipboard is a valid outline
     if pBnodes==[] or pBnodes[0]!=1:
@@ -1108,7 +1581,7 @@ def voom_OopPaste(): #{{{2
     ### adjust levels of new headlines, insert them in Tree
     if levDelta:
         pTlines = setLevTreeLines(pTlines, levels, ln1-1)
-    Tree[ln:ln] = pTlines
+    treeSetLines(VO, ln, ln, pTlines)
 
     ### start and end lnums of inserted region
     vim.command('let l:ln1=%s' %ln1)
@@ -1117,6 +1590,8 @@ def voom_OopPaste(): #{{{2
     Tree[ln1-1] = '=' + Tree[ln1-1][1:]
     VO.snLn = ln1
 
+    oopRangeAdd(VO, ln, ln2+1, ln, ln2-ln)
+
     # do this last to tell vim script that there were no errors
     vim.command('let l:blnShow=%s' %blnShow)
 
@@ -1159,19 +1634,19 @@ def voom_OopUp(): #{{{2
     bln1 = bnodes[ln1-1]
     if ln2 < len(bnodes): bln2 = bnodes[ln2]-1
     else: bln2 = len(Body)
-    blines = Body[bln1-1:bln2]
+    blines = None # new lines of range being moved if they change
     if levDelta:
         f = VO.changeLevBodyHead
         if f:
+            blines = Body[bln1-1:bln2]
             for bl in bnodes[ln1-1:ln2]:
                 blines[bl-bln1] = f(VO, blines[bl-bln1], levDelta)
 
-    ### move body lines: cut, then insert
+    ### move body lines: swap range being moved and range before it
     # insert before line blnUp1, it will not change after bnodes update
     blnUp1 = bnodes[lnUp1-1]
     blnShow = blnUp1
-    Body[bln1-1:bln2] = []
-    Body[blnUp1-1:blnUp1-1] = blines
+    swapLines(Body, blnUp1-1, bln1-1, bln2, None, blines)
 
     ###update bnodes
     # increment lnums in the range before which the move is made
@@ -1198,8 +1673,8 @@ def voom_OopUp(): #{{{2
     if VO.hook_doBodyAfterOop:
         VO.hook_doBodyAfterOop(VO, 'up', levDelta,
                     blnShow, lnUp1,
-                    blnShow+len(blines)-1, lnUp1+len(nLevels)-1,
-                    bln1-1+len(blines), ln1-1+len(nLevels))
+                    blnShow+bln2-bln1, lnUp1+len(nLevels)-1,
+                    bln2, ln1-1+len(nLevels))
 
     ### ---go back to Tree---
     vim.command("call voom#OopFromBody(%s,%s,%s)" %(body,tree,blnShow))
@@ -1209,17 +1684,17 @@ def voom_OopUp(): #{{{2
     Tree[snLn-1] = ' ' + Tree[snLn-1][1:]
 
     ### update Tree (same as for levels)
-    tlines = Tree[ln1-1:ln2]
+    tlines = None
     if levDelta:
-        tlines = setLevTreeLines(tlines, levels, lnUp1-1)
-    # cut, then insert
-    Tree[ln1-1:ln2] = []
-    Tree[lnUp1-1:lnUp1-1] = tlines
+        tlines = setLevTreeLines(Tree[ln1-1:ln2], levels, lnUp1-1)
+    swapLines(Tree, lnUp1-1, ln1-1, ln2, None, tlines, VO)
 
     ### add snLn mark
     Tree[lnUp1-1] = '=' + Tree[lnUp1-1][1:]
     VO.snLn = lnUp1
 
+    oopRangeAdd(VO, lnUp1, ln2)
+
     # do this last to tell vim script that there were no errors
     vim.command('let l:blnShow=%s' %blnShow)
 
@@ -1267,18 +1742,18 @@ def voom_OopDown(): #{{{2
     ### body lines to move
     bln1 = bnodes[ln1-1]
     bln2 = bnodes[ln2]-1
-    blines = Body[bln1-1:bln2]
+    blines = None # new lines of range being moved if they change
     if levDelta:
         f = VO.changeLevBodyHead
         if f:
+            blines = Body[bln1-1:bln2]
             for bl in bnodes[ln1-1:ln2]:
                 blines[bl-bln1] = f(VO, blines[bl-bln1], levDelta)
 
-    ### move body lines: insert, then cut
+    ### move body lines: swap range being moved and range after it
     if lnIns < len(bnodes): blnIns = bnodes[lnIns]-1
     else: blnIns = len(Body)
-    Body[blnIns:blnIns] = blines
-    Body[bln1-1:bln2] = []
+    swapLines(Body, bln1-1, bln2, blnIns, blines, None)
 
     ### update bnodes
     # increment lnums in the range which is being moved
@@ -1313,7 +1788,7 @@ def voom_OopDown(): #{{{2
     if VO.hook_doBodyAfterOop:
         VO.hook_doBodyAfterOop(VO, 'down', levDelta,
                     blnShow, snLn,
-                    blnShow+len(blines)-1, snLn+len(nLevels)-1,
+                    blnShow+bln2-bln1, snLn+len(nLevels)-1,
                     bln1-1, ln1-1)
 
     ### ---go back to Tree---
@@ -1323,16 +1798,16 @@ def voom_OopDown(): #{{{2
     Tree[snLn_-1] = ' ' + Tree[snLn_-1][1:]
 
     ### update Tree (same as for levels)
-    tlines = Tree[ln1-1:ln2]
+    tlines = None
     if levDelta:
-        tlines = setLevTreeLines(tlines, levels, snLn-1)
-    # insert, then cut
-    Tree[lnIns:lnIns] = tlines
-    Tree[ln1-1:ln2] = []
+        tlines = setLevTreeLines(Tree[ln1-1:ln2], levels, snLn-1)
+    swapLines(Tree, ln1-1, ln2, lnIns, tlines, None, VO)
 
     ### add snLn mark
     Tree[snLn-1] = '=' + Tree[snLn-1][1:]
 
+    oopRangeAdd(VO, ln1, lnIns)
+
     # do this last to tell vim script that there were no errors
     vim.command('let l:blnShow=%s' %blnShow)
 
@@ -1379,7 +1854,7 @@ def voom_OopRight(): #{{{2
     ### change levels of Tree lines (same as for VO.levels)
     tlines = Tree[ln1-1:ln2]
     tlines = setLevTreeLines(tlines, levels, ln1-1)
-    Tree[ln1-1:ln2] = tlines
+    treeSetLines(VO, ln1-1, ln2, tlines)
 
     ### set snLn to ln1
     snLn = VO.snLn
@@ -1389,6 +1864,8 @@ def voom_OopRight(): #{{{2
         Tree[snLn-1] = '=' + Tree[snLn-1][1:]
         VO.snLn = snLn
 
+    oopRangeAdd(VO, ln1, ln2)
+
     # do this last to tell vim script that there were no errors
     vim.command('let l:blnShow=%s' %blnShow)
 
@@ -1440,7 +1917,7 @@ def voom_OopLeft(): #{{{2
     ### change levels of Tree lines (same as for VO.levels)
     tlines = Tree[ln1-1:ln2]
     tlines = setLevTreeLines(tlines, levels, ln1-1)
-    Tree[ln1-1:ln2] = tlines
+    treeSetLines(VO, ln1-1, ln2, tlines)
 
     ### set snLn to ln1
     snLn = VO.snLn
@@ -1450,6 +1927,8 @@ def voom_OopLeft(): #{{{2
         Tree[snLn-1] = '=' + Tree[snLn-1][1:]
         VO.snLn = snLn
 
+    oopRangeAdd(VO, ln1, ln2)
+
     # do this last to tell vim script that there were no errors
     vim.command('let l:blnShow=%s' %blnShow)
 
@@ -1462,17 +1941,22 @@ def voom_OopMark(): # {{{2
     Body, Tree = VO.Body, VO.Tree
     bnodes, levels = VO.bnodes, VO.levels
     marker_re = VO.marker_re
+    oopRangeAdd(VO, ln1, ln2)
 
-    for i in xrange(ln1-1,ln2):
+    tlines = Tree[ln1-1:ln2]
+    blines = {}
+    for i in xrange(len(tlines)):
         # insert 'x' in Tree line
-        tline = Tree[i]
+        tline = tlines[i]
         if tline[1]!='x':
-            Tree[i] = '%sx%s' %(tline[0], tline[2:])
+            tlines[i] = '%sx%s' %(tline[0], tline[2:])
             # insert 'x' in Body headline
-            bln = bnodes[i]
-            bline = Body[bln-1]
+            bline = Body[bnodes[ln1-1+i]-1]
             end = marker_re.search(bline).end(1)
-            Body[bln-1] = '%sx%s' %(bline[:end], bline[end:])
+            blines[ln1+i] = '%sx%s' %(bline[:end], bline[end:])
+    if blines:
+        Tree[ln1-1:ln2] = tlines
+        setBodyHeads(VO, blines)
 
 
 def voom_OopUnmark(): # {{{2
@@ -1483,20 +1967,25 @@ def voom_OopUnmark(): # {{{2
     Body, Tree = VO.Body, VO.Tree
     bnodes, levels = VO.bnodes, VO.levels
     marker_re = VO.marker_re
+    oopRangeAdd(VO, ln1, ln2)
 
-    for i in xrange(ln1-1,ln2):
+    tlines = Tree[ln1-1:ln2]
+    blines = {}
+    for i in xrange(len(tlines)):
         # remove 'x' from Tree line
-        tline = Tree[i]
+        tline = tlines[i]
         if tline[1]=='x':
-            Tree[i] = '%s %s' %(tline[0], tline[2:])
+            tlines[i] = '%s %s' %(tline[0], tline[2:])
             # remove 'x' from Body headline
-            bln = bnodes[i]
-            bline = Body[bln-1]
+            bline = Body[bnodes[ln1-1+i]-1]
             end = marker_re.search(bline).end(1)
             # remove one 'x', not enough
-            #Body[bln-1] = '%s%s' %(bline[:end], bline[end+1:])
+            #blines[ln1+i] = '%s%s' %(bline[:end], bline[end+1:])
             # remove all consecutive 'x' chars
-            Body[bln-1] = '%s%s' %(bline[:end], bline[end:].lstrip('x'))
+            blines[ln1+i] = '%s%s' %(bline[:end], bline[end:].lstrip('x'))
+    if blines:
+        Tree[ln1-1:ln2] = tlines
+        setBodyHeads(VO, blines)
 
 
 def voom_OopMarkStartup(): # {{{2
@@ -1508,39 +1997,31 @@ def voom_OopMarkStartup(): # {{{2
     bnodes, levels = VO.bnodes, VO.levels
     marker_re = VO.marker_re
 
-    if ln==1:
-        bln_selected = 0
-    else:
-        bln_selected = bnodes[ln-1]
+    # Tree lnums of nodes marked with '='
+    flags = fmrFlags(VO)
+    lnums = [i+1 for i in xrange(1,len(flags)) if flags[i]&4]
+    blines = {}
     # remove '=' from all other Body headlines
     # also, strip 'x' and 'o' after removed '='
-    for bln in bnodes[1:]:
-        if bln==bln_selected: continue
-        bline = Body[bln-1]
+    for lnum in lnums:
+        if lnum==ln: continue
+        bline = Body[bnodes[lnum-1]-1]
         end = marker_re.search(bline).end()
-        bline2 = bline[end:]
-        if not bline2: continue
-        if bline2[0]=='=':
-            Body[bln-1] = '%s%s' %(bline[:end], bline[end:].lstrip('=xo'))
-        elif bline2[0]=='o' and bline2[1:] and bline2[1]=='=':
-            Body[bln-1] = '%s%s' %(bline[:end+1], bline[end+1:].lstrip('=xo'))
-
-    if ln==1: return
+        if bline[end:end+1]=='o':
+            end+=1
+        blines[lnum] = '%s%s' %(bline[:end], bline[end:].lstrip('=xo'))
 
     # insert '=' in current Body headline, but only if it's not there already
-    bline = Body[bln_selected-1]
-    end = marker_re.search(bline).end()
-    bline2 = bline[end:]
-    if not bline2:
-        Body[bln_selected-1] = '%s=' %bline
-        return
-    if bline2[0]=='=':
-        return
-    elif bline2[0]=='o' and bline2[1:] and bline2[1]=='=':
-        return
-    elif bline2[0]=='o':
-        end+=1
-    Body[bln_selected-1] = '%s=%s' %(bline[:end], bline[end:])
+    if ln > 1 and not ln in lnums:
+        bline = Body[bnodes[ln-1]-1]
+        end = marker_re.search(bline).end()
+        if bline[end:end+1]=='o':
+            end+=1
+        blines[ln] = '%s=%s' %(bline[:end], bline[end:])
+
+    if not blines: return
+    setBodyHeads(VO, blines)
+    oopRangeAdd(VO, min(blines), max(blines))
 
 
 #--- Tree Folding Operations --- {{{2
@@ -1583,12 +2064,18 @@ def voom_OopFolding(action): #{{{3
 
     if action=='save':
         cFolds = foldingGet(ln1, ln2)
-        foldingWrite(VO, ln1, ln2, cFolds)
+        heads = foldingWrite(VO, ln1, ln2, cFolds)
     elif action=='restore':
         cFolds = foldingRead(VO, ln1, ln2)
         foldingCreate(ln1, ln2, cFolds)
+        return
     elif action=='cleanup':
-        foldingCleanup(VO)
+        heads = foldingCleanup(VO)
+
+    # tell vim script that Body was changed
+    if heads:
+        oopRangeAdd(VO, min(heads), max(heads))
+        vim.command('let l:changed=1')
 
 
 def foldingGet(ln1, ln2): #{{{3
@@ -1657,16 +2144,12 @@ def foldingFlip(VO, ln1, ln2, folds): #{{{3
 def foldingRead(VO, ln1, ln2): #{{{3
     """Read "o" marks in Body headlines."""
     cFolds = []
-    marker_re = VO.marker_re
-    bnodes = VO.bnodes
-    Body = VO.Body
+    flags = fmrFlags(VO)
 
     for ln in xrange(ln1,ln2+1):
         if not nodeHasChildren(VO, ln):
             continue
-        bline = Body[bnodes[ln-1]-1]
-        end = marker_re.search(bline).end()
-        if end<len(bline) and bline[end]=='o':
+        if flags[ln-1]&2:
             continue
         else:
             cFolds.append(ln)
@@ -1676,47 +2159,60 @@ def foldingRead(VO, ln1, ln2): #{{{3
 
 
 def foldingWrite(VO, ln1, ln2, cFolds): #{{{3
-    """Write "o" marks in Body headlines."""
+    """Write "o" marks in Body headlines.
+    Return dict {Tree lnum: new Body headline} of changed headlines.
+    """
     cFolds = {}.fromkeys(cFolds)
-    marker_re = VO.marker_re
-    bnodes = VO.bnodes
+    marker_re_search = VO.marker_re.search
+    bnodes, levels = VO.bnodes, VO.levels
     Body = VO.Body
+    flags = fmrFlags(VO)
+    heads = {}
 
-    for ln in xrange(ln1,ln2+1):
-        if not nodeHasChildren(VO, ln):
+    # first and last nodes have no children
+    for ln in xrange(max(ln1,2), min(ln2,len(levels)-1)+1):
+        if not levels[ln-1] < levels[ln]:
             continue
-        bln = bnodes[ln-1]
-        bline = Body[bln-1]
-        end = marker_re.search(bline).end()
         isClosed = ln in cFolds
-        # headline is marked with 'o'
-        if end<len(bline) and bline[end]=='o':
-            # remove 'o' mark
-            if isClosed:
-                Body[bln-1] = '%s%s' %(bline[:end], bline[end:].lstrip('ox'))
-        # headline is not marked with 'o'
+        # nothing to do if headline is marked with 'o' and fold is opened,
+        # or if headline is not marked with 'o' and fold is closed
+        if bool(flags[ln-1]&2) != isClosed:
+            continue
+        bline = Body[bnodes[ln-1]-1]
+        end = marker_re_search(bline).end()
+        # remove 'o' mark
+        if isClosed:
+            heads[ln] = '%s%s' %(bline[:end], bline[end:].lstrip('ox'))
+        # add 'o' mark
         else:
-            # add 'o' mark
-            if not isClosed:
-                if end==len(bline):
-                    Body[bln-1] = '%so' %bline
-                elif bline[end] != 'o':
-                    Body[bln-1] = '%so%s' %(bline[:end], bline[end:])
+            heads[ln] = '%so%s' %(bline[:end], bline[end:])
+
+    if heads:
+        setBodyHeads(VO, heads)
+    return heads
 
 
 def foldingCleanup(VO): #{{{3
-    """Remove "o" marks from  from nodes without children."""
-    marker_re = VO.marker_re
-    bnodes = VO.bnodes
+    """Remove "o" marks from  from nodes without children.
+    Return dict {Tree lnum: new Body headline} of changed headlines.
+    """
+    marker_re_search = VO.marker_re.search
+    bnodes, levels = VO.bnodes, VO.levels
     Body = VO.Body
+    flags = fmrFlags(VO)
+    heads = {}
 
-    for ln in xrange(2,len(bnodes)+1):
-        if nodeHasChildren(VO, ln): continue
-        bln = bnodes[ln-1]
-        bline = Body[bln-1]
-        end = marker_re.search(bline).end()
-        if end<len(bline) and bline[end]=='o':
-            Body[bln-1] = '%s%s' %(bline[:end], bline[end:].lstrip('ox'))
+    z = len(levels)
+    for ln in xrange(2,z+1):
+        if not flags[ln-1]&2: continue
+        if ln < z and levels[ln-1] < levels[ln]: continue
+        bline = Body[bnodes[ln-1]-1]
+        end = marker_re_search(bline).end()
+        heads[ln] = '%s%s' %(bline[:end], bline[end:].lstrip('ox'))
+
+    if heads:
+        setBodyHeads(VO, heads)
+    return heads
 
 
 #--- Sort Operations --- {{{2
@@ -1739,16 +2235,22 @@ def foldingCleanup(VO): #{{{3
 # - Do sort for each group of siblings in the list: from right to left and from
 #   bottom to top.
 #
-# 3) We modify only the Body buffer. We then do global outline update to redraw
-# the Tree and to update outline data. Performing targeted update as in other
-# outline operations is too tedious.
+# 3) The new order of all nodes in the region is computed first, as one
+# permutation of their Tree lnums. The Body region is then replaced with one
+# write. Sorting does not change headlines or the number of nodes, so if
+# headlines do not depend on preceding Body lines (VO.headsContextFree),
+# VO.bnodes, VO.levels and Tree lines of the region are permuted in place and
+# the region is added to VO.oopRange with oopRangeAdd() for verification.
+# Otherwise, Tree BufEnter au does global outline update as before.
 
 
 def voom_OopSort(): #{{{3
     # Returning before setting l:blnShow means no changes were made.
     ### parse options {{{
     oDeep = False
-    D = {'oIgnorecase':0, 'oUnicode':0, 'oEnc':0, 'oReverse':0, 'oFlip':0, 'oShuffle':0}
+    D = {'oIgnorecase':0, 'oUnicode':0, 'oEnc':0, 'oReverse':0, 'oFlip':0, 'oShuffle':0, 'oKey':None}
+    # number of key options: n, num, date, key=
+    nKeys = 0
     options = vim.eval('a:qargs')
     options = options.strip().split()
     for o in options:
@@ -1758,15 +2260,33 @@ def voom_OopSort(): #{{{3
         elif o=='r':       D['oReverse']    = 1 # sort in reverse order
         elif o=='flip':    D['oFlip']       = 1 # reverse without sorting
         elif o=='shuffle': D['oShuffle']    = 1
+        elif o in SORT_KEYS:
+            D['oKey'] = SORT_KEYS[o]
+            nKeys+=1
+        elif o.startswith('key='):
+            # name of Python callable, evaluated in the namespace of :python
+            try:
+                f = eval(o[4:], sys.modules['__main__'].__dict__)
+            except Exception:
+                f = None
+            if not callable(f):
+                vim.command("call voom#ErrorMsg('VOoM (sort): not a Python callable: %s')" %o[4:].replace("'","''"))
+                return
+            D['oKey'] = f
+            nKeys+=1
         else:
             vim.command("call voom#ErrorMsg('VOoM (sort): invalid option: %s')" %o.replace("'","''"))
-            vim.command("call voom#WarningMsg('VOoM (sort): valid options are: deep, i (ignore-case), u (unicode), r (reverse-sort), flip, shuffle')")
+            vim.command("call voom#WarningMsg('VOoM (sort): valid options are: deep, i (ignore-case), u (unicode), r (reverse-sort), flip, shuffle, n (natural), num (numeric), date, key={callable}')")
             return
 
     if (D['oReverse'] + D['oFlip'] + D['oShuffle']) > 1:
         vim.command("call voom#ErrorMsg('VOoM (sort): these options cannot be combined: r, flip, shuffle')")
         return
 
+    if nKeys > 1 or (nKeys and (D['oFlip'] or D['oShuffle'])):
+        vim.command("call voom#ErrorMsg('VOoM (sort): these options cannot be combined: n, num, date, key=, flip, shuffle')")
+        return
+
     if D['oShuffle']:
         global shuffle
         if shuffle is None: from random import shuffle
@@ -1797,15 +2317,36 @@ def voom_OopSort(): #{{{3
     #print ln1, ln2, siblings
 
     ### do sorting
+    # Sort each group of siblings. Result is new order of all nodes in the
+    # region as list of their current Tree lnums. Body and outline data are
+    # changed only once, after all sorting is done.
+    lnum1 = siblings[0]
+    lnum2 = siblings[-1] + nodeSubnodes(VO,siblings[-1])
+    tlines = Tree[lnum1-1:lnum2]
     # progress flags: (got >1 siblings, order changed after sort)
     flag1,flag2 = 0,0
     if not oDeep:
-        flag1,flag2 = sortSiblings(VO, siblings, **D)
+        groups = [siblings]
     else:
-        siblings_groups = getSiblingsGroups(VO,siblings)
-        for group in siblings_groups:
-            m, n = sortSiblings(VO, group, **D)
-            flag1+=m; flag2+=n
+        groups = getSiblingsGroups(VO,siblings)
+    # {lnum of parent: sorted children, ...}, children of parent p start at p+1
+    groups_sorted = {}
+    # {headline text: sort key, ...}, shared by all groups
+    keys = {}
+    for group in groups:
+        try:
+            group_sorted = sortSiblings(VO, group, tlines, lnum1, keys, **D)
+        except Exception:
+            # most likely error in user-supplied key=
+            e = sys.exc_info()[1]
+            msg = '%s: %s' %(e.__class__.__name__, e)
+            vim.command("call voom#ErrorMsg('VOoM (sort): ERROR while computing sort key: %s')" %msg.replace("'","''"))
+            return
+        if len(group) > 1:
+            flag1+=1
+            if group_sorted != group: flag2+=1
+        groups_sorted[group[0]-1] = group_sorted
+    sibs_sorted = groups_sorted.pop(lnum1-1)
 
     if flag1==0:
         vim.command("call voom#WarningMsg('VOoM (sort): nothing to sort')")
@@ -1814,35 +2355,124 @@ def voom_OopSort(): #{{{3
         vim.command("call voom#WarningMsg('VOoM (sort): already sorted')")
         return
 
+    ### new order of nodes
+    # Walk the tree of sorted groups depth-first. Branches of nodes that are
+    # not in groups_sorted (not deep sort) are taken as is.
+    perm = []
+    perm_add = perm.append
+    stack = sibs_sorted[::-1]
+    while stack:
+        ln = stack.pop()
+        perm_add(ln)
+        if ln in groups_sorted:
+            stack.extend(groups_sorted[ln][::-1])
+        else:
+            perm.extend(xrange(ln+1, ln+1+nodeSubnodes(VO,ln)))
+    assert len(perm) == lnum2-lnum1+1
+
+    ### construct new Body region from Body regions of nodes
+    Z, body_len = len(bnodes), len(Body)
+    blnum1 = bnodes[lnum1-1]
+    if lnum2 < Z:
+        blnum2 = bnodes[lnum2]-1
+    else:
+        blnum2 = body_len
+    blines_old = Body[blnum1-1:blnum2]
+    blines = []
+    bnodes_new = []
+    for ln in perm:
+        bln1 = bnodes[ln-1]
+        if ln < Z:
+            bln2 = bnodes[ln]-1
+        else:
+            bln2 = body_len
+        bnodes_new.append(blnum1+len(blines))
+        blines.extend(blines_old[bln1-blnum1:bln2-blnum1+1])
+
+    ### replace Body region with the new, sorted region
+    Body[blnum1-1:blnum2] = blines
+    assert body_len == len(Body)
+
+    ### Update outline data and Tree directly if headlines are not affected
+    # by the preceding Body lines. Otherwise rely on Tree BufEnter au.
+    if VO.headsContextFree:
+        levels[lnum1-1:lnum2] = [levels[ln-1] for ln in perm]
+        bnodes[lnum1-1:lnum2] = bnodes_new
+        # snLn mark moves together with its Tree line
+        snLn = VO.snLn
+        if lnum1 <= snLn <= lnum2:
+            VO.snLn = lnum1 + perm.index(snLn)
+        treeSetLines(VO, lnum1-1, lnum2, [tlines[ln-lnum1] for ln in perm])
+        oopRangeAdd(VO, lnum1, lnum2)
+        vim.command('let l:doverif=1')
+
     # Show first sibling. Tracking the current node and bnode is too hard.
-    lnum1 = siblings[0]
-    lnum2 = siblings[-1] + nodeSubnodes(VO,siblings[-1])
     blnShow = bnodes[lnum1-1]
     vim.command('let [l:blnShow,l:lnum1,l:lnum2]=[%s,%s,%s]' %(blnShow,lnum1,lnum2))
 
 
-def sortSiblings(VO, siblings, oIgnorecase, oUnicode, oEnc, oReverse, oFlip, oShuffle): #{{{3
+# Sort keys for :VoomSort options n, num, date. The argument is Tree headline
+# text, after processing by options u and i.
+NATURAL_SPLIT = re.compile(r'(\d+)').split
+NUMBER_MATCH = re.compile(r'\s*([-+]?(?:\d+\.?\d*|\.\d+))').match
+DATE_MATCH = re.compile(r'\s*(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})').match
+
+def sortKeyNatural(head): #{{{3
+    """Natural order: numbers in headlines are compared as integers.
+    'v1.9' < 'v1.10' < 'v2.0'
+    """
+    parts = NATURAL_SPLIT(head)
+    parts[1::2] = [int(n) for n in parts[1::2]]
+    return parts
+
+
+def sortKeyNumeric(head): #{{{3
+    """Numeric prefix: '2 b' < '10 a' < '10.5' < headlines without number."""
+    m = NUMBER_MATCH(head)
+    if m:
+        return (0, float(m.group(1)), head)
+    return (1, 0, head)
+
+
+def sortKeyDate(head): #{{{3
+    """Date prefix YYYY-MM-DD, also YYYY/MM/DD, YYYY.MM.DD. Headlines
+    without date go last.
+    """
+    m = DATE_MATCH(head)
+    if m:
+        return (0, (int(m.group(1)), int(m.group(2)), int(m.group(3))), head)
+    return (1, (), head)
+
+
+SORT_KEYS = {'n':sortKeyNatural, 'num':sortKeyNumeric, 'date':sortKeyDate}
+
+
+def sortSiblings(VO, siblings, tlines, lnum1, keys, oIgnorecase, oUnicode, oEnc, oReverse, oFlip, oShuffle, oKey): #{{{3
     """Sort sibling nodes. 'siblings' is list of Tree lnums in ascending order.
-    This only modifies Body buffer. Outline data are not updated.
-    Return progress flags (flag1,flag2), see voom_OopSort().
+    tlines is list of Tree lines starting with Tree line lnum1.
+    keys is dict of computed sort keys {headline: key}, used if oKey.
+    Return list of siblings in new order. Nothing is modified.
     """
     sibs = siblings
     if len(sibs) < 2:
-        return (0,0)
-    Body, Tree = VO.Body, VO.Tree
-    bnodes, levels = VO.bnodes, VO.levels
-    z, Z = len(sibs), len(bnodes)
+        return sibs
 
     ### decorate siblings for sorting
-    # [(Tree headline text, index, lnum), ...]
+    # [(Tree headline text or sort key, index, lnum), ...]
     sibs_dec = []
-    for i in xrange(z):
+    for i in xrange(len(sibs)):
         sib = sibs[i]
-        head = Tree[sib-1].split('|',1)[1]
+        head = tlines[sib-lnum1].split('|',1)[1]
         if oUnicode and oEnc:
             head = unicode(head, oEnc, 'replace')
         if oIgnorecase:
             head = head.lower()
+        if oKey:
+            if head in keys:
+                head = keys[head]
+            else:
+                k = keys[head] = oKey(head)
+                head = k
         sibs_dec.append((head, i, sib))
 
     ### sort
@@ -1855,46 +2485,7 @@ def sortSiblings(VO, siblings, oIgnorecase, oUnicode, oEnc, oReverse, oFlip, oSh
     else:
         sibs_dec.sort()
 
-    sibs_sorted = [i[2] for i in sibs_dec]
-    #print sibs_dec; print sibs_sorted
-    if sibs==sibs_sorted:
-        return (1,0)
-
-    ### blnum1, blnum2: first and last Body lnums of the affected region
-    blnum1 = bnodes[sibs[0]-1]
-    n = sibs[-1] + nodeSubnodes(VO,sibs[-1])
-    if n < Z:
-        blnum2 = bnodes[n]-1
-    else:
-        blnum2 = len(Body)
-
-    ### construct new Body region
-    blines = []
-    for i in xrange(z):
-        sib = sibs[i]
-        j = sibs_dec[i][1] # index into sibs that points to new sib
-        sib_new = sibs[j]
-
-        # get Body region for sib_new branch
-        bln1 = bnodes[sib_new-1]
-        if j+1 < z:
-            sib_next = sibs[j+1]
-            bln2 = bnodes[sib_next-1]-1
-        else:
-            node_last = sib_new + nodeSubnodes(VO,sib_new)
-            if node_last < Z:
-                bln2 = bnodes[node_last]-1
-            else:
-                bln2 = len(Body)
-
-        blines.extend(Body[bln1-1:bln2])
-
-    ### replace Body region with the new, sorted region
-    body_len = len(Body)
-    Body[blnum1-1:blnum2] = blines
-    assert body_len == len(Body)
-
-    return (1,1)
+    return [i[2] for i in sibs_dec]
 
 
 #---EXECUTE SCRIPT----------------------------{{{1
@@ -1919,26 +2510,316 @@ def voom_GetBuffRange(): #{{{2
 
 
 def voom_Exec(): #{{{2
+    # sys.stdout and sys.stderr are replaced while background script runs
+    if execBgRunning(): return
+    body = int(vim.eval('l:body'))
     if vim.eval('l:bufType')=='Tree':
-        Buf = VOOMS[int(vim.eval('l:body'))].Body
+        Buf = VOOMS[body].Body
     else:
         Buf = vim.current.buffer
     bln1, bln2 = int(vim.eval('l:bln1')), int(vim.eval('l:bln2'))
-    blines = Buf[bln1-1:bln2]
+    changed = vim.eval('l:changed')=='1'
+    if changed or EXEC_PERSISTENT:
+        d = execNamespace(body)
+    else:
+        d = {'vim':vim, '_VOoM':sys.modules['voom_vim']}
+    # buffer PyLog writes while the script runs, see LogBufferClass.flush()
+    log = sys.stdout
+    if not isinstance(log, LogBufferClass):
+        log = None
+    if log:
+        # LOG_FLUSH_TIME counts from the start of the script
+        log.buffering, log.flushTime = True, time.time()
+    try:
+        if changed:
+            execChanged(VOOMS[body], d, bln1, bln2)
+            return
+        blines = Buf[bln1-1:bln2]
+        try:
+            code = execCompile(body, bln1, bln2, blines)
+            exec code in d
+        #except Exception: # does not catch vim.error
+        except:
+            #traceback.print_exc()  # writes to sys.stderr
+            printTraceback(bln1,bln2)
+
+        print '---end of Python script (%s-%s)---' %(bln1,bln2)
+    finally:
+        if log:
+            log.buffering = False
+            log.flush()
+
+
+def voom_ExecReset(): #{{{2
+    """Delete persistent Voomexec namespace of buffer l:body."""
+    body = int(vim.eval('l:body'))
+    execFree(body)
+    vim.command("echo 'VOoM: Voomexec namespace of buffer %s has been deleted'" %body)
+
+
+def voom_ExecFree(): #{{{2
+    """Buffer a:body is deleted or wiped out."""
+    execFree(int(vim.eval('a:body')))
+
+
+# Persistent namespaces of Voomexec Python scripts: {body: dict, ...}
+EXEC_NS = {}
+# Nodes executed by "Voomexec changed" in namespace EXEC_NS[body]:
+# {body: set of chained md5 digests of node and preceding nodes, ...}
+EXEC_DONE = {}
+
+
+def execNamespace(body): #{{{2
+    """Return persistent namespace for Voomexec scripts from buffer body."""
+    if not body in EXEC_NS:
+        EXEC_NS[body] = {'vim':vim, '_VOoM':sys.modules['voom_vim']}
+        # free it when the buffer is deleted, also needed for non-VOoM buffers
+        vim.command('call voom#ExecBufAu(%s)' %body)
+    return EXEC_NS[body]
+
+
+def execFree(body): #{{{2
+    """Delete persistent namespace and cached code objects of buffer body."""
+    if body in EXEC_NS: del EXEC_NS[body]
+    if body in EXEC_DONE: del EXEC_DONE[body]
+    for key in [k for k in EXEC_CODE if k[0]==body]:
+        del EXEC_CODE[key]
+
+
+def execChanged(VO, d, bln1, bln2): #{{{2
+    """Execute Body lines bln1-bln2 in namespace d node by node, in outline
+    order. Skip nodes that were executed in d before and are unchanged, and
+    so are all preceding nodes (notebook-style). Stop at the first error.
+    """
+    global md5
+    if md5 is None: from hashlib import md5
+    Body, body = VO.Body, VO.body
+    # Body lnums of node starts in the range
+    bnodes = VO.bnodes
+    starts = [bln1] + bnodes[bisect.bisect_right(bnodes, bln1):bisect.bisect_right(bnodes, bln2)]
+    starts.append(bln2+1)
+    done = EXEC_DONE.get(body, ())
+    # digests of nodes skipped so far
+    skipped = []
+    h = ''
+    nRun = 0
+    for i in xrange(len(starts)-1):
+        b1, b2 = starts[i], starts[i+1]-1
+        blines = Body[b1-1:b2]
+        h = md5('%s%s' %(h, '\n'.join(blines))).digest()
+        if h in done:
+            skipped.append(h)
+            continue
+        # Executing a node invalidates results of all nodes that follow it:
+        # only nodes skipped so far remain done.
+        if not nRun:
+            done = EXEC_DONE[body] = set(skipped)
+        nRun+=1
+        try:
+            code = execCompile(body, b1, b2, blines)
+            exec code in d
+        except:
+            printTraceback(b1,b2)
+            break
+        done.add(h)
+
+    print '---end of Python script (%s-%s): %s nodes executed, %s unchanged nodes skipped---' %(bln1,bln2,nRun,len(skipped))
+
+
+# Code objects of scripts compiled by execCompile():
+# {(body, bln1, bln2): (md5 digest of script, code), ...}
+EXEC_CODE = {}
+
+
+def execCompile(body, bln1, bln2, blines): #{{{2
+    """Compile Voomexec script: lines blines, which are Body lines bln1-bln2.
+    Line numbers in the code object are Body lnums. The code object is cached
+    and reused while script text and its location are unchanged.
+    """
+    global md5, ast
     # specifiy script encoding (Vim internal encoding) on the first line
-    enc = '# -*- coding: %s -*-' %get_vim_encoding()
-    # prepend extra \n's to make traceback lnums match buffer lnums
-    # TODO: find less silly way to adjust traceback lnums
-    script = '%s\n%s%s\n' %(enc, '\n'*(bln1-2), '\n'.join(blines))
-    d = {'vim':vim, '_VOoM':sys.modules['voom_vim']}
+    script = '# -*- coding: %s -*-\n%s\n' %(get_vim_encoding(), '\n'.join(blines))
+    if md5 is None: from hashlib import md5
+    digest = md5(script).digest()
+    key = (body, bln1, bln2)
+    if key in EXEC_CODE and EXEC_CODE[key][0]==digest:
+        return EXEC_CODE[key][1]
+    if ast is None: import ast
+    # script line 2 is Body line bln1
     try:
-        exec script in d
-    #except Exception: # does not catch vim.error
+        tree = compile(script, '<string>', 'exec', ast.PyCF_ONLY_AST)
+    except SyntaxError, e:
+        if e.lineno:
+            e.lineno += bln1-2
+            e.args = (e.msg, (e.filename, e.lineno, e.offset, e.text))
+        raise
+    ast.increment_lineno(tree, bln1-2)
+    code = compile(tree, '<string>', 'exec')
+    if len(EXEC_CODE) > 100:
+        EXEC_CODE.clear()
+    EXEC_CODE[key] = (digest, code)
+    return code
+
+
+# Background Python script started by "Voomexec bg", instance of ExecJob.
+EXEC_JOB = None
+
+
+class ExecJob: #{{{2
+    """Python script executed in a worker thread by "Voomexec bg".
+    Output of the thread is collected in self.output and printed from the main
+    thread by voom_ExecPoll().
+    """
+    def __init__(self, code, d, bln1, bln2): #{{{3
+        self.code, self.d = code, d
+        self.bln1, self.bln2 = bln1, bln2
+        # [(sys.stdout or sys.stderr, string written to it), ...]
+        self.output = []
+        self.lock = threading.Lock()
+        self.stdout, self.stderr = sys.stdout, sys.stderr
+        self.thread = threading.Thread(target=self.run)
+        self.thread.setDaemon(True)
+        self.cancelled = False
+        self.start = self.end = time.time()
+
+    def run(self): #{{{3
+        """Executed in the worker thread. Vim must not be used here."""
+        try:
+            exec self.code in self.d
+        except:
+            printTraceback(self.bln1,self.bln2)
+        self.end = time.time()
+
+
+class VimStub: #{{{2
+    """Replaces modules vim and voom_vim in namespace of "Voomexec bg"
+    script. Vim must not be used from a worker thread.
+    """
+    def __getattr__(self, name):
+        raise RuntimeError('VOoM: Vim cannot be used by background script (Voomexec bg)')
+
+
+class ExecOutputClass: #{{{2
+    """Replaces sys.stdout and sys.stderr while "Voomexec bg" script runs.
+    out is the replaced stream. Strings written by the script's thread are
+    added to job output as (out, string), others are written to out.
+    """
+    def __init__(self, job, out): #{{{3
+        self.job, self.out = job, out
+
+    def write(self,s): #{{{3
+        job = self.job
+        if threading.currentThread() is job.thread:
+            job.lock.acquire()
+            try:
+                job.output.append((self.out, s))
+            finally:
+                job.lock.release()
+        else:
+            self.out.write(s)
+
+    def flush(self): #{{{3
+        if hasattr(self.out, 'flush') and not threading.currentThread() is self.job.thread:
+            self.out.flush()
+
+
+def voom_ExecBg(): #{{{2
+    """Start executing Python script, Body lines l:bln1-l:bln2, in a worker
+    thread. Vim timer calls voom_ExecPoll() until the script is finished.
+    """
+    global EXEC_JOB, threading
+    if execBgRunning(): return
+    if threading is None: import threading
+    body = int(vim.eval('l:body'))
+    if vim.eval('l:bufType')=='Tree':
+        Buf = VOOMS[body].Body
+    else:
+        Buf = vim.current.buffer
+    bln1, bln2 = int(vim.eval('l:bln1')), int(vim.eval('l:bln2'))
+    blines = Buf[bln1-1:bln2]
+    # The script gets its own namespace, a copy of the persistent one if any:
+    # the persistent namespace is not modified from a worker thread. Vim is
+    # not available: 'vim' and '_VOoM' are replaced by VimStub.
+    if EXEC_PERSISTENT:
+        d = execNamespace(body).copy()
+    else:
+        d = {}
+    d['vim'] = d['_VOoM'] = VimStub()
+    try:
+        code = execCompile(body, bln1, bln2, blines)
     except:
-        #traceback.print_exc()  # writes to sys.stderr
         printTraceback(bln1,bln2)
+        print '---end of Python script (%s-%s)---' %(bln1,bln2)
+        return
+    job = ExecJob(code, d, bln1, bln2)
+    sys.stdout = ExecOutputClass(job, job.stdout)
+    sys.stderr = ExecOutputClass(job, job.stderr)
+    EXEC_JOB = job
+    job.thread.start()
+    vim.command('let l:started=1')
+
+
+def execBgRunning(): #{{{2
+    """Return True if "Voomexec bg" script is running, show error message."""
+    if not EXEC_JOB:
+        return False
+    vim.command("call voom#ErrorMsg('VOoM: background script (%s-%s) is still running, use \"Voomexec cancel\" to cancel it')" %(EXEC_JOB.bln1, EXEC_JOB.bln2))
+    return True
+
+
+def voom_ExecPoll(): #{{{2
+    """Print output of background script. Set l:done when it is finished."""
+    global EXEC_JOB
+    job = EXEC_JOB
+    if not job:
+        vim.command('let l:done=1')
+        return
+    finished = not job.thread.isAlive()
+    job.lock.acquire()
+    try:
+        output, job.output = job.output, []
+    finally:
+        job.lock.release()
+    # write consecutive strings for the same stream at once
+    i, Z = 0, len(output)
+    while i < Z:
+        out = output[i][0]
+        j = i+1
+        while j < Z and output[j][0] is out:
+            j+=1
+        out.write(''.join([o[1] for o in output[i:j]]))
+        i = j
+    if not finished:
+        return
+    if isinstance(sys.stdout, ExecOutputClass) and sys.stdout.job is job:
+        sys.stdout = job.stdout
+    if isinstance(sys.stderr, ExecOutputClass) and sys.stderr.job is job:
+        sys.stderr = job.stderr
+    EXEC_JOB = None
+    if job.cancelled:
+        status = 'cancelled after'
+    else:
+        status = 'finished in'
+    print '---end of Python script (%s-%s), %s %.2f s---' %(job.bln1, job.bln2, status, job.end-job.start)
+    vim.command('let l:done=1')
+
+
+def voom_ExecCancel(): #{{{2
+    """Cancel background script: raise KeyboardInterrupt in its thread."""
+    job = EXEC_JOB
+    if not job or not job.thread.isAlive():
+        vim.command("call voom#ErrorMsg('VOoM: no background script is running')")
+        return
+    try:
+        import ctypes
+        res = ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_long(job.thread.ident), ctypes.py_object(KeyboardInterrupt))
+    except (ImportError, AttributeError):
+        res = 0
+    if res != 1:
+        vim.command("call voom#ErrorMsg('VOoM: failed to cancel background script')")
+        return
+    job.cancelled = True
 
-    print '---end of Python script (%s-%s)---' %(bln1,bln2)
 
 # id_20101214100357
 # NOTES on printing Python tracebacks and Vim errors.
@@ -1970,7 +2851,12 @@ def printTraceback(bln1,bln2): #{{{2
     # like traceback.format_exc(), traceback.print_exc()
     try:
         etype, value, tb = sys.exc_info()
-        out = traceback.format_exception(etype, value, tb)
+        if isinstance(value, SyntaxError) and tb and tb.tb_next and \
+                tb.tb_next.tb_frame.f_code is execCompile.func_code:
+            # script failed to compile: omit traceback of execCompile()
+            out = ['Traceback (most recent call last):\n', ''] + traceback.format_exception_only(etype, value)
+        else:
+            out = traceback.format_exception(etype, value, tb)
         #out = traceback.format_exception(etype, value, tb.tb_next)
     finally:
         etype = value = tb = None
@@ -1978,8 +2864,6 @@ def printTraceback(bln1,bln2): #{{{2
         sys.stderr.write('ERROR: Voomexec failed to format Python traceback')
         return
     info = '  ...exception executing script (%s-%s)...\n' %(bln1,bln2)
-    if bln1==1:
-        info += '  ...subtract 1 from traceback lnums to get buffer lnums...\n'
     out[1:2] = [info]
     #out[1:1] = [info]
     sys.stderr.write(''.join(out))
@@ -1987,6 +2871,17 @@ def printTraceback(bln1,bln2): #{{{2
 
 #---LOG BUFFER--------------------------------{{{1
 #
+# When buffering, pending output is flushed to PyLog buffer after this many
+# characters or after this many seconds since the last flush.
+LOG_FLUSH_SIZE = 65536
+LOG_FLUSH_TIME = 0.5
+# Ring mode: when g:voom_log_max_lines is set and the PyLog buffer exceeds it
+# by 10%, the oldest lines are deleted to leave g:voom_log_max_lines lines.
+# Deleted lines are appended to file g:voom_log_spill_file if it is set. The
+# file is renamed to <file>.1 when it grows over LOG_SPILL_SIZE bytes.
+LOG_SPILL_SIZE = 1048576
+
+
 class LogBufferClass: #{{{2
     """A file-like object for replacing sys.stdout and sys.stdin with a Vim buffer."""
     def __init__(self): #{{{3
@@ -1996,9 +2891,37 @@ class LogBufferClass: #{{{2
         #self.encoding = vim.eval('&enc')
         self.encoding = get_vim_encoding()
         self.join = False
+        # When buffering is on (set by voom_Exec()), strings are collected in
+        # self.pending and written by flush() in one append with one scroll.
+        self.buffering = False
+        self.pending = []
+        self.size = 0
+        self.flushTime = time.time()
+        # ring mode settings, see LOG_SPILL_SIZE
+        if vim.eval("exists('g:voom_log_max_lines')")=='1':
+            self.maxLines = int(vim.eval('g:voom_log_max_lines'))
+        else:
+            self.maxLines = 0
+        if vim.eval("exists('g:voom_log_spill_file')")=='1':
+            self.spillFile = os.path.expanduser(vim.eval('g:voom_log_spill_file'))
+        else:
+            self.spillFile = ''
 
     def write(self,s): #{{{3
-        """Append string to buffer, scroll Log windows in all tabs."""
+        """Append string to buffer, scroll Log windows in all tabs.
+        If buffering, string is added to pending output, which is written when
+        it is large enough or after LOG_FLUSH_TIME seconds.
+        """
+        if not s: return
+        self.pending.append(s)
+        if self.buffering:
+            self.size += len(s)
+            if self.size < LOG_FLUSH_SIZE and time.time()-self.flushTime < LOG_FLUSH_TIME:
+                return
+        self.flush()
+
+    def flush(self): #{{{3
+        """Write pending output to buffer, scroll Log windows in all tabs."""
         # Messages are terminated by sending '\n' (null string? ^@).
         # Thus "print '\n'" sends '\n' twice.
         # The message itself can contain '\n's.
@@ -2012,24 +2935,32 @@ class LogBufferClass: #{{{2
         # A trailing \n is lost after splitlines(), but not for '\n\n' etc.
         #print self.buffer.name
 
-        if not s: return
+        if not self.pending: return
+        pending, self.pending, self.size = self.pending, [], 0
+        self.flushTime = time.time()
         # Nasty things happen when printing to unloaded PyLog buffer.
         # This also catches printing to noexisting buffer, as in pydoc help() glitch.
         if vim.eval("bufloaded(%s)" %self.logbnr)=='0':
             vim.command("call voom#ErrorMsg('VOoM (PyLog): PyLog buffer %s is unloaded or doesn''t exist')" %self.logbnr)
             vim.command("call voom#ErrorMsg('VOoM (PyLog): unable to write string:')")
-            vim.command("echom '%s'" %(repr(s).replace("'", "''")) )
+            for s in pending:
+                vim.command("echom '%s'" %(repr(s).replace("'", "''")) )
             vim.command("call voom#ErrorMsg('VOoM (PyLog): please try executing command :Voomlog to fix')")
             return
+        s = pending
         try:
-            if type(s) == type(u" "):
-                s = s.encode(self.encoding)
+            for i in xrange(len(pending)):
+                if type(pending[i]) == type(u" "):
+                    pending[i] = pending[i].encode(self.encoding)
+            s = ''.join(pending)
             # Join with previous message if it had no ending newline.
             if self.join:
                 s = self.buffer[-1] + s
                 del self.buffer[-1]
             self.join = not s[-1]=='\n'
             self.buffer.append(s.splitlines())
+            if self.maxLines and len(self.buffer) > self.maxLines + self.maxLines//10:
+                self.trim()
         except:
             # list of all exception lines, no newlines in items
             exc_lines = traceback.format_exc().splitlines()
@@ -2041,14 +2972,42 @@ class LogBufferClass: #{{{2
 
         vim.command('call voom#LogScroll()')
 
+    def trim(self): #{{{3
+        """Ring mode: delete the oldest lines in bulk, leave self.maxLines lines.
+        Deleted lines are appended to self.spillFile if it is set.
+        """
+        k = len(self.buffer) - self.maxLines
+        if self.spillFile:
+            lines = self.buffer[:k]
+            lines.append('')
+            f = self.spillFile
+            try:
+                if os.path.exists(f) and os.path.getsize(f) > LOG_SPILL_SIZE:
+                    if os.path.exists(f+'.1'):
+                        os.remove(f+'.1')
+                    os.rename(f, f+'.1')
+                fh = open(f, 'ab')
+                try:
+                    fh.write('\n'.join(lines))
+                finally:
+                    fh.close()
+            except (IOError, OSError):
+                # stop spilling, keep trimming
+                self.spillFile = ''
+                self.buffer.append('VOoM: exception writing PyLog spill file, spilling is disabled:')
+                self.buffer.append(traceback.format_exc().splitlines())
+                k = len(self.buffer) - self.maxLines
+        del self.buffer[:k]
+
 
 #---misc--------------------------------------{{{1
 
-def get_vim_encoding(): #{{{2
-    """Return Vim internal encoding."""
+def get_vim_encoding(enc=None): #{{{2
+    """Return Vim internal encoding. enc is value of &enc if known."""
     # When &enc is any Unicode Vim allegedly uses utf-8 internally.
     # See |encoding|, mbyte.c, values are from |encoding-values|
-    enc = vim.eval('&enc')
+    if enc is None:
+        enc = vim.eval('&enc')
     if enc in ('utf-8','ucs-2','ucs-2le','utf-16','utf-16le','ucs-4','ucs-4le'):
         return 'utf-8'
     return enc
@@ -0,0 +1,66 @@
+# test_voom_mode_latex.py
+# Tests for ../autoload/voom/voom_mode_latex.py . Run outside of Vim with
+#   python -m unittest discover -s test
+
+import os, sys
+import types
+import unittest
+
+# voom_mode_latex imports module vim, which exists only inside Vim.
+# None of g:voom_latex_ options is set.
+if not 'vim' in sys.modules:
+    sys.modules['vim'] = types.ModuleType('vim')
+vim = sys.modules['vim']
+vim.eval = lambda s: '0'
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'autoload', 'voom'))
+import voom_mode_latex
+
+
+class VO: Body = None
+
+
+class TestMakeOutline(unittest.TestCase):
+
+    def outline(self, blines):
+        return voom_mode_latex.hook_makeOutline(VO(), blines)
+
+    def test_outline(self):
+        # Expected outline is what the code before dispatch on command names
+        # (CMD_RE) and get_verb_end() produced.
+        blines = [r'\documentclass{article}',
+                  r'\begin{document}',
+                  r'\section{Intro} % comment',
+                  r'% \section{Commented out}',
+                  r'  %\subsection{Also commented}',
+                  r'\verb|\section{not a section}|',
+                  r'\verb+\begin{verbatim}+ text',
+                  r'\subsection*{Starred {with} braces}',
+                  r'\begin{verbatim}',
+                  r'\section{In verbatim}',
+                  r'  \end{verbatim}',
+                  r'\section[Short]{Long title}',
+                  r'\begin{comment}',
+                  r'\subsection{In comment}',
+                  r'\end {comment}',
+                  r'  \subsubsection* {Inset starred}',
+                  r'\sectionx{Not a section}',
+                  r'\partial x',
+                  r'\paragraph{Para}',
+                  r'\bibliography{refs}',
+                  r'\end{document}']
+        tlines = [' -|\\begin{document}', '  |Intro', ' *. |Starred {with} braces',
+                  '  |Long title', ' *. . |Inset starred', '  . . . |Para',
+                  ' -|\\bibliography{refs}', ' -|\\end{document}']
+        self.assertEqual(self.outline(blines),
+                         (tlines, [2, 3, 8, 12, 16, 19, 20, 21], [1, 1, 2, 1, 3, 4, 1, 1]))
+
+    def test_unclosed_verbatim(self):
+        # everything after \begin{verbatim} without \end{verbatim} is ignored
+        blines = [r'\section{A}', r'\begin{verbatim}', r'\section{B}', r'\end{verbatim*}',
+                  r'\section{C}']
+        self.assertEqual(self.outline(blines), (['  |A'], [1], [1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
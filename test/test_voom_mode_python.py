@@ -0,0 +1,41 @@
+# test_voom_mode_python.py
+# Tests for ../autoload/voom/voom_mode_python.py . Run outside of Vim with
+#   python -m unittest discover -s test
+
+import os, sys
+import types
+import unittest
+
+# voom_mode_python imports module vim, which exists only inside Vim.
+if not 'vim' in sys.modules:
+    vim = types.ModuleType('vim')
+    vim.command = lambda s: None
+    sys.modules['vim'] = vim
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'autoload', 'voom'))
+import voom_mode_python
+
+
+class VO: pass
+
+
+class TestMakeOutline(unittest.TestCase):
+
+    def outline(self, blines):
+        return voom_mode_python.hook_makeOutline(VO(), blines)
+
+    def test_deeply_nested_brackets(self):
+        # parser.suite() raises MemoryError (parser stack overflow),
+        # must fall back to tokenize
+        blines = ['x = %s1%s' %('('*200, ')'*200), 'def f(): pass']
+        self.assertEqual(self.outline(blines), (['  |def f(): pass'], [2], [1]))
+
+    def test_scan_same_as_tokenize(self):
+        blines = ['import os', 's = """a', 'def no():', '"""',
+                  'class A:', '    def f(self, a,', '          b):', '        pass']
+        self.assertEqual(voom_mode_python.get_lnums_from_scan(blines),
+                         voom_mode_python.get_lnums_from_tokenize(blines))
+
+
+if __name__ == '__main__':
+    unittest.main()
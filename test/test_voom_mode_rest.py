@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# test_voom_mode_rest.py
+# Tests for ../autoload/voom/voom_mode_rest.py . Run outside of Vim with
+#   python -m unittest discover -s test
+
+import os, sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'autoload', 'voom'))
+import voom_mode_rest
+
+
+class VO:
+    Body = None
+    enc = 'utf-8'
+
+
+class TestMakeOutline(unittest.TestCase):
+
+    # Underlines and overlines must be as long as the title in chars, not in
+    # bytes. Expected outlines are what the code before ulen() and FIRST_CHARS
+    # produced.
+    blines = ['Intro text.',
+              '',
+              '日本語',
+              '===',
+              '',
+              '中文标题',
+              '---',
+              '',
+              '=======',
+              ' Ünïcödé ',
+              '=======',
+              '',
+              '**',
+              '한국어',
+              '**',
+              '',
+              '====',
+              ' 日本 ',
+              '====',
+              '',
+              '中文标题',
+              '----',
+              '',
+              '日本語',
+              '~~~~~~',
+              '',
+              '  inset',
+              '  -----',
+              '',
+              'abc',
+              '---',
+              'text']
+
+    def outline(self, blines, enc='utf-8'):
+        vo = VO()
+        vo.enc = enc
+        return voom_mode_rest.hook_makeOutline(vo, blines)
+
+    def test_wide_chars(self):
+        tlines = ['  |日本語', '  . |日本', '  . . |中文标题', '  . . . |日本語', '  . . |abc']
+        self.assertEqual(self.outline(self.blines),
+                         (tlines, [3, 17, 21, 24, 30], [1, 2, 3, 4, 3]))
+        # cached lengths give the same result
+        self.assertEqual(self.outline(self.blines),
+                         (tlines, [3, 17, 21, 24, 30], [1, 2, 3, 4, 3]))
+
+    def test_wide_chars_latin1(self):
+        # every byte is a char
+        self.assertEqual(self.outline(self.blines, 'latin-1'), (['  |abc'], [30], [1]))
+
+    def test_ulen(self):
+        self.assertEqual(voom_mode_rest.ulen('abc', 'utf-8'), 3)
+        self.assertEqual(voom_mode_rest.ulen('日本語', 'utf-8'), 3)
+        self.assertEqual(voom_mode_rest.ulen('日本語', 'latin-1'), 9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+# test_voom_nav.py
+# Tests for outline navigation data in ../autoload/voom/voom_vim.py . Run
+# outside of Vim with
+#   python -m unittest discover -s test
+
+import os, sys
+import types
+import random
+import unittest
+
+# voom_vim imports module vim, which exists only inside Vim.
+if not 'vim' in sys.modules:
+    sys.modules['vim'] = types.ModuleType('vim')
+vim = sys.modules['vim']
+vim.command = lambda s: None
+# Vim settings read by voom_vim at import, none of g:voom_ options is set
+VIMVARS = {'g': {'ft_modes': [], 'default_mode': [], 'clipboard_register': [],
+                 'always_allow_move_left': [], 'exec_persistent': []},
+           'clipboard': '0', 'setreg': '0', 'bindeval': '0'}
+vim.eval = lambda s: VIMVARS
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'autoload', 'voom'))
+import voom_vim
+
+
+class VO:
+    def __init__(self, levels):
+        self.levels = [1] + levels
+        self.navIndex = self.oopRange = None
+
+
+def scanParent(levels, lnum):
+    """Tree lnum of parent of node lnum: the nearest preceding node with a
+    smaller level, 1 if there is none.
+    """
+    lev = levels[lnum-1]
+    for i in xrange(lnum-2, 0, -1):
+        if levels[i] < lev:
+            return i+1
+    return 1
+
+
+def randomLevels(n):
+    """Levels of n nodes. Levels can jump up by more than 1 (irregular
+    outline) and down by any number.
+    """
+    levels, lev = [], 1
+    for i in xrange(n):
+        levels.append(lev)
+        lev = random.choice([1, lev-1, lev, lev, lev+1, lev+1, lev+3])
+        lev = max(lev, 1)
+    return levels
+
+
+class TestNavIndex(unittest.TestCase):
+
+    def check(self, vo):
+        parents, siblings, positions = voom_vim.navIndex(vo)
+        for lnum in xrange(2, len(vo.levels)+1):
+            sibs = voom_vim.nodeSiblings(vo, lnum)
+            self.assertEqual(siblings[lnum-1], sibs)
+            self.assertEqual(positions[lnum-1], sibs.index(lnum))
+            self.assertEqual(parents[lnum-1], scanParent(vo.levels, lnum))
+
+    def test_irregular(self):
+        self.check(VO([1, 3, 2, 3, 1, 4, 4, 2, 1]))
+        self.check(VO([2, 1, 3]))
+        self.check(VO([]))
+
+    def test_random(self):
+        random.seed(1)
+        for n in (1, 2, 10, 100, 1000):
+            self.check(VO(randomLevels(n)))
+
+    def test_cache(self):
+        vo = VO([1, 2, 2])
+        index = voom_vim.navIndex(vo)
+        self.assertTrue(voom_vim.navIndex(vo) is index)
+        # outline changed
+        voom_vim.oopRangeAdd(vo, 3, 3)
+        vo.levels[3] = 3
+        self.check(vo)
+
+
+if __name__ == '__main__':
+    unittest.main()
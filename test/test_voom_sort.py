@@ -0,0 +1,140 @@
+# test_voom_sort.py
+# Tests for :VoomSort code in ../autoload/voom/voom_vim.py . Run outside of Vim
+# with
+#   python -m unittest discover -s test
+
+import os, sys
+import types
+import unittest
+
+# voom_vim imports module vim, which exists only inside Vim. Tests replace
+# vim.eval(), vim.command(), vim.current as needed.
+if not 'vim' in sys.modules:
+    sys.modules['vim'] = types.ModuleType('vim')
+vim = sys.modules['vim']
+vim.command = lambda s: None
+# Vim settings read by voom_vim at import, none of g:voom_ options is set
+VIMVARS = {'g': {'ft_modes': [], 'default_mode': [], 'clipboard_register': [],
+                 'always_allow_move_left': [], 'exec_persistent': []},
+           'clipboard': '0', 'setreg': '0', 'bindeval': '0'}
+vim.eval = lambda s: VIMVARS
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'autoload', 'voom'))
+import voom_vim
+voom_vim.VOOMS = {}
+
+
+def makeVO(mmode, blines):
+    """Create outline of Body lines blines in markup mode mmode (default mode
+    if ''), as voom#Init() and voom#TreeCreate() would do.
+    """
+    S = {'bnr': '1', 'firstLine': ' body [dir], b1', 'qargs': mmode, 'ft': '', 'enc': 'utf-8',
+         'fmr': '{{{,}}}', 'cms': '/*%s*/', 'rstrip': []} #}}}
+    vim.eval = lambda s: S
+    vim.current = types.ModuleType('current')
+    vim.current.buffer = blines
+    voom_vim.voom_Init(1)
+    VO = voom_vim.VOOMS[1]
+    tlines, bnodes, levels = VO.makeOutline(VO, blines)
+    VO.tree = 2
+    VO.Tree = [VO.bname] + tlines
+    VO.bnodes, VO.levels = [1] + bnodes, [1] + levels
+    VO.Tree[0] = '=%s' %VO.Tree[0][1:]
+    return VO
+
+
+def oopSort(VO, ln1, ln2, qargs):
+    """Run voom_OopSort() for Tree lines ln1-ln2. Return Vim commands."""
+    E = {'a:qargs': qargs, 'l:body': '1', 'l:tree': '2', 'a:ln1': str(ln1), 'a:ln2': str(ln2)}
+    vim.eval = E.get
+    cmds = []
+    vim.command = cmds.append
+    voom_vim.voom_OopSort()
+    vim.command = lambda s: None
+    return cmds
+
+
+def sortHeads(heads, **opts):
+    """Sort headlines heads as siblings with sortSiblings(), return them in
+    new order.
+    """
+    D = {'oIgnorecase':0, 'oUnicode':0, 'oEnc':0, 'oReverse':0, 'oFlip':0, 'oShuffle':0, 'oKey':None}
+    D.update(opts)
+    tlines = [' |%s' %h for h in heads]
+    sibs = range(1, len(heads)+1)
+    return [heads[i-1] for i in voom_vim.sortSiblings(None, sibs, tlines, 1, {}, **D)]
+
+
+class TestSortKeys(unittest.TestCase):
+
+    def test_natural(self):
+        heads = ['v2.0', 'v1.10', 'a', 'v1.9']
+        self.assertEqual(sortHeads(heads, oKey=voom_vim.sortKeyNatural),
+                         ['a', 'v1.9', 'v1.10', 'v2.0'])
+        self.assertEqual(sortHeads(heads), ['a', 'v1.10', 'v1.9', 'v2.0'])
+
+    def test_numeric(self):
+        heads = ['x', '10 a', '10.5', '2 b', '-1']
+        self.assertEqual(sortHeads(heads, oKey=voom_vim.sortKeyNumeric),
+                         ['-1', '2 b', '10 a', '10.5', 'x'])
+
+    def test_date(self):
+        heads = ['no date', '2014/1/5 b', '2013-12-31 a', '2014.01.04']
+        self.assertEqual(sortHeads(heads, oKey=voom_vim.sortKeyDate),
+                         ['2013-12-31 a', '2014.01.04', '2014/1/5 b', 'no date'])
+
+    def test_reverse_flip(self):
+        heads = ['b', 'c', 'a']
+        self.assertEqual(sortHeads(heads, oReverse=1), ['c', 'b', 'a'])
+        self.assertEqual(sortHeads(heads, oFlip=1), ['a', 'c', 'b'])
+        self.assertEqual(sortHeads(['v2', 'v10', 'v1'], oKey=voom_vim.sortKeyNatural, oReverse=1),
+                         ['v10', 'v2', 'v1'])
+
+    def test_ignorecase(self):
+        heads = ['b', 'C', 'a', 'B']
+        self.assertEqual(sortHeads(heads), ['B', 'C', 'a', 'b'])
+        # stable: 'b' before 'B'
+        self.assertEqual(sortHeads(heads, oIgnorecase=1), ['a', 'b', 'B', 'C'])
+
+
+class TestOopSort(unittest.TestCase):
+
+    blines = ['top', 'c {{{1', 'c body', 'b {{{1', 'b2 {{{2', 'b1 {{{2', 'b1 body',
+              'a {{{1', 'a body']
+
+    def test_sort(self):
+        VO = makeVO('', self.blines[:])
+        cmds = oopSort(VO, 2, 2, 'deep')
+        self.assertTrue('let l:doverif=1' in cmds)
+        self.assertEqual(VO.Body, ['top', 'a {{{1', 'a body', 'b {{{1', 'b1 {{{2', 'b1 body',
+                                   'b2 {{{2', 'c {{{1', 'c body'])
+        # bnodes, levels and Tree lines were permuted together
+        tlines, bnodes, levels = VO.makeOutline(VO, VO.Body)
+        self.assertEqual(VO.bnodes, [1] + bnodes)
+        self.assertEqual(VO.levels, [1] + levels)
+        self.assertEqual(VO.Tree[1:], tlines)
+        self.assertEqual(VO.oopRange, [2, 6])
+
+    def test_not_context_free(self):
+        # Body changed, outline data are left to global outline update
+        VO = makeVO('txt2tags', ['= b =', 'b body', '= a =', 'a body'])
+        bnodes, levels, Tree = VO.bnodes[:], VO.levels[:], VO.Tree[:]
+        cmds = oopSort(VO, 2, 2, '')
+        self.assertFalse('let l:doverif=1' in cmds)
+        self.assertEqual(VO.Body, ['= a =', 'a body', '= b =', 'b body'])
+        self.assertEqual((VO.bnodes, VO.levels, VO.Tree), (bnodes, levels, Tree))
+
+    def test_bad_key(self):
+        VO = makeVO('', self.blines[:])
+        cmds = oopSort(VO, 2, 2, 'key=no_such_name')
+        self.assertTrue('not a Python callable: no_such_name' in cmds[0])
+        # key raises ValueError
+        cmds = oopSort(VO, 2, 2, 'key=int')
+        self.assertTrue('ERROR while computing sort key: ValueError' in cmds[0])
+        cmds = oopSort(VO, 2, 2, 'key=int n')
+        self.assertTrue('cannot be combined' in cmds[0])
+        self.assertEqual(VO.Body, self.blines)
+
+
+if __name__ == '__main__':
+    unittest.main()
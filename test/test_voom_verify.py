@@ -0,0 +1,97 @@
+# test_voom_verify.py
+# Tests for outline verification in ../autoload/voom/voom_vim.py . Run outside
+# of Vim with
+#   python -m unittest discover -s test
+
+import os, sys
+import types
+import unittest
+
+# voom_vim imports module vim, which exists only inside Vim. Tests replace
+# vim.eval(), vim.command(), vim.current as needed.
+if not 'vim' in sys.modules:
+    sys.modules['vim'] = types.ModuleType('vim')
+vim = sys.modules['vim']
+vim.command = lambda s: None
+# Vim settings read by voom_vim at import, none of g:voom_ options is set
+VIMVARS = {'g': {'ft_modes': [], 'default_mode': [], 'clipboard_register': [],
+                 'always_allow_move_left': [], 'exec_persistent': []},
+           'clipboard': '0', 'setreg': '0', 'bindeval': '0'}
+vim.eval = lambda s: VIMVARS
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'autoload', 'voom'))
+import voom_vim
+voom_vim.VOOMS = {}
+
+
+def makeVO(mmode, blines):
+    """Create outline of Body lines blines in markup mode mmode (default mode
+    if ''), as voom#Init() and voom#TreeCreate() would do.
+    """
+    S = {'bnr': '1', 'firstLine': ' body [dir], b1', 'qargs': mmode, 'ft': '', 'enc': 'utf-8',
+         'fmr': '{{{,}}}', 'cms': '/*%s*/', 'rstrip': []} #}}}
+    vim.eval = lambda s: S
+    vim.current = types.ModuleType('current')
+    vim.current.buffer = blines
+    voom_vim.voom_Init(1)
+    VO = voom_vim.VOOMS[1]
+    tlines, bnodes, levels = VO.makeOutline(VO, blines)
+    VO.tree = 2
+    VO.Tree = [VO.bname] + tlines
+    VO.bnodes, VO.levels = [1] + bnodes, [1] + levels
+    VO.Tree[0] = '=%s' %VO.Tree[0][1:]
+    return VO
+
+
+def oopVerify(VO, full='0'):
+    """Run voom_OopVerify(). Return (value of l:ok, error messages)."""
+    E = {'a:body': '1', 'a:tree': '2', 'l:full': full}
+    vim.eval = E.get
+    cmds = []
+    vim.command = cmds.append
+    voom_vim.voom_OopVerify()
+    vim.command = lambda s: None
+    ok = "let l:ok=1" in cmds
+    return ok, [c for c in cmds if 'ErrorMsg' in c]
+
+
+class TestOopVerify(unittest.TestCase):
+
+    def test_heads_context_free(self):
+        for mmode in ('', 'fmr', 'fmr1', 'fmr2', 'cwiki', 'hashes', 'html', 'org', 'vimwiki', 'wiki'):
+            self.assertTrue(makeVO(mmode, ['x']).headsContextFree, mmode)
+        for mmode in ('txt2tags', 'viki', 'markdown', 'rest', 'python', 'latex'):
+            self.assertFalse(makeVO(mmode, ['x']).headsContextFree, mmode)
+
+    def test_partial(self):
+        blines = ['= A =', '== B ==', '== C ==', '= D =']
+        VO = makeVO('wiki', blines)
+        VO.oopRange = [3, 3]
+        self.assertEqual(oopVerify(VO), (True, []))
+        # node C changed level, D is not re-parsed
+        VO.levels[3] = 1
+        VO.oopRange = [3, 3]
+        ok, errors = oopVerify(VO)
+        self.assertFalse(ok)
+        self.assertTrue('wrong levels' in errors[0])
+
+    def test_fenced_txt2tags(self):
+        # Lines 3-5 are inside Verbatim Area, they are not headlines. Parsing
+        # only nodes around C (lines 3-6) would not see the opening fence.
+        blines = ['= A =', '```', '= B =', '= C =', '= E =', '```', '= D =']
+        VO = makeVO('txt2tags', blines)
+        self.assertEqual(VO.bnodes, [1, 1, 7])
+        # corrupt outline: B, C, E are nodes
+        VO.bnodes = [1, 1, 3, 4, 5, 7]
+        VO.levels = [1, 1, 1, 1, 1, 1]
+        VO.Tree = VO.Tree[:2] + ['  |B', '  |C', '  |E'] + VO.Tree[2:]
+        self.assertTrue(voom_vim.oopVerifyRange(VO, 4, 4)) # partial check is fooled
+        VO.oopRange = [4, 4]
+        ok, errors = oopVerify(VO)
+        self.assertFalse(ok)
+        self.assertTrue('wrong Tree size' in errors[0])
+        self.assertEqual(VO.oopRange, None)
+
+
+if __name__ == '__main__':
+    unittest.main()